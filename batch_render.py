@@ -0,0 +1,207 @@
+"""Worker-pool rendering of many combined videos at once"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import psutil
+
+import encoder_profiles
+import ffmpeg_render
+import output_cache
+import profiling
+import renderer
+import segment_cache
+
+CPU_COUNT = os.cpu_count() or 1
+DEFAULT_WORKERS = min(4, CPU_COUNT)
+
+
+def default_threads(workers):
+    """Split the machine's cores evenly between workers"""
+    return max(1, CPU_COUNT // max(1, workers))
+
+
+def make_job(index, segments, output_path, backend=renderer.DEFAULT_BACKEND, threads=None, tag=None, options=None):
+    """Describe one combined video to render
+
+    tag groups the job's encoder processes so a whole batch can be canceled.
+    Without an output_path the video is delivered straight from the output cache.
+    """
+    output_key = output_cache.output_key(segments, backend, options)
+    return {
+        "index": index,
+        "segments": segments,
+        "output_path": output_path or output_cache.output_path(output_key),
+        "output_key": output_key,
+        "backend": backend,
+        "threads": threads,
+        "tag": tag,
+        "options": options or {},
+    }
+
+
+def job_result(job, backend=None, error=None, seconds=0.0, canceled=False, resources=None, reused=False, profile=None):
+    """Outcome of one job as reported back to the caller"""
+    output_bytes = os.path.getsize(job["output_path"]) if not error and os.path.exists(job["output_path"]) else 0
+    return {
+        "index": job["index"],
+        "output_path": job["output_path"],
+        "output_bytes": output_bytes,
+        "encoder_profile": encoder_profiles.profile_name(job.get("options")),
+        "backend": backend,
+        # The native backend failed and MoviePy rendered the video instead
+        "fallback": backend is not None and backend != job["backend"],
+        "error": error,
+        "canceled": canceled,
+        "reused": reused,
+        "seconds": seconds,
+        "resources": resources,
+        "profile": profile,
+    }
+
+
+def planned_output_seconds(job):
+    """Length of the combined video a job will produce"""
+    total = 0.0
+    for seg in job["segments"]:
+        try:
+            total += ffmpeg_render.played_duration(seg)
+        except ValueError:
+            continue  # Empty windows are reported when the job renders
+    return total
+
+
+def job_fps(job):
+    """Frame rate the job's backend renders at"""
+    if job["backend"] == renderer.BACKEND_SEGMENTS:
+        return segment_cache.SEGMENT_FPS
+    return ffmpeg_render.output_fps(job["segments"])
+
+
+def resource_usage():
+    """Open handles, child processes and RSS of the rendering process, sampled after a job
+
+    Flat numbers over a long batch show readers and encoders are being released.
+    """
+    process = psutil.Process()
+    try:
+        handles = process.num_fds()
+    except AttributeError:  # Windows has handles, not file descriptors
+        handles = process.num_handles()
+    return {
+        "open_handles": handles,
+        "child_processes": len(process.children(recursive=True)),
+        "rss_bytes": process.memory_info().rss,
+    }
+
+
+def render_job(job):
+    """Render one job and report the outcome instead of raising"""
+    started = time.time()
+    ffmpeg_render.set_cancel_tag(job.get("tag"))
+    profiling.start()
+    try:
+        backend, reused = render_or_reuse(job)
+        profile = profiling.finish(planned_output_seconds(job), job_fps(job))
+        return job_result(job, backend=backend, seconds=time.time() - started, resources=resource_usage(), reused=reused, profile=profile)
+    except ffmpeg_render.RenderCanceled:
+        return job_result(job, error="Canceled", canceled=True, seconds=time.time() - started)
+    except Exception as e:
+        return job_result(job, error=str(e), seconds=time.time() - started, resources=resource_usage())
+    finally:
+        profiling.finish()
+        ffmpeg_render.set_cancel_tag(None)
+
+
+def render_or_reuse(job):
+    """Render a job through the output cache; returns (backend, reused)
+
+    A video whose recipe was rendered before is linked from the cache instead.
+    With the reuse_outputs option off it is always rendered again.
+    """
+    options = job.get("options") or {}
+    key = job.get("output_key") or output_cache.output_key(job["segments"], job["backend"], options)
+    with output_cache.key_lock(key):
+        backend = output_cache.lookup(key) if options.get("reuse_outputs", True) else None
+        reused = backend is not None
+        if not reused:
+            backend = output_cache.render_into(
+                key,
+                lambda path: renderer.render_sequence(job["segments"], path, job["backend"], job["threads"], options),
+            )
+        output_cache.publish(key, job["output_path"])
+    return backend, reused
+
+
+def make_executor(backend, workers):
+    """Pick a pool that actually runs renders in parallel for the given backend
+
+    The ffmpeg backend already does its work in a child process, so threads are
+    enough to keep several encoders busy. MoviePy renders frames in Python and
+    needs separate (spawned, not forked from the server) processes.
+    """
+    if backend == renderer.BACKEND_MOVIEPY:
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render")
+
+
+def kill_pool_processes(executor):
+    """Kill a process pool's workers together with any encoders they started"""
+    for process in list(getattr(executor, "_processes", {}).values()):
+        try:
+            worker = psutil.Process(process.pid)
+            for child in worker.children(recursive=True):
+                child.kill()
+            worker.kill()
+        except psutil.NoSuchProcess:
+            continue
+
+
+def run_batch(jobs, workers=DEFAULT_WORKERS, on_result=None, should_stop=None, poll_interval=0.5):
+    """Render all jobs with up to `workers` at a time and return results in job order
+
+    on_result(result, completed, total) is called from the calling thread as each
+    job finishes. should_stop() is polled every poll_interval seconds; when it
+    returns True, in-flight encoders are killed and unfinished jobs are reported
+    as canceled.
+    """
+    if not jobs:
+        return []
+    backend = jobs[0]["backend"]
+    tag = jobs[0].get("tag")
+    results = {}
+    aborted = False
+    executor = make_executor(backend, workers)
+    futures = {executor.submit(render_job, job): job for job in jobs}
+    pending = set(futures)
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # A worker that died outright (e.g. killed by the OS) is reported, not raised
+                    result = job_result(job, error=str(e))
+                results[job["index"]] = result
+                if on_result:
+                    on_result(result, len(results), len(jobs))
+
+            if pending and should_stop and should_stop():
+                aborted = True
+                for future in pending:
+                    future.cancel()
+                ffmpeg_render.cancel_processes(tag)
+                if isinstance(executor, ProcessPoolExecutor):
+                    kill_pool_processes(executor)
+                for future in pending:
+                    job = futures[future]
+                    results[job["index"]] = job_result(job, error="Canceled", canceled=True)
+                break
+    finally:
+        # Render threads exit promptly once their encoders are killed; killed pool workers cannot be joined
+        executor.shutdown(wait=not (aborted and isinstance(executor, ProcessPoolExecutor)), cancel_futures=True)
+        ffmpeg_render.release_tag(tag)
+    return [results[index] for index in sorted(results)]
@@ -0,0 +1,61 @@
+"""Synthetic source videos for benchmarks, generated offline with ffmpeg.
+
+Fixtures cover the shapes uploads come in (portrait and landscape, several
+frame rates, with and without audio). They are deterministic and cached by
+spec, so repeated runs measure the same inputs.
+"""
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+
+from moviepy.config import FFMPEG_BINARY
+
+FIXTURE_DIR = os.environ.get(
+    "VIDEO_EDITOR_BENCH_FIXTURE_DIR",
+    os.path.join(tempfile.gettempdir(), "auto_video_editor", "bench_fixtures"),
+)
+
+# name, width, height, fps, seconds, has_audio
+FIXTURES = [
+    ("portrait_1080p30_audio", 1080, 1920, 30, 8, True),
+    ("portrait_720p25_silent", 720, 1280, 25, 6, False),
+    ("landscape_720p30_audio", 1280, 720, 30, 6, True),
+    ("square_480p24_audio", 480, 480, 24, 5, True),
+    ("portrait_1080p60_audio", 1080, 1920, 60, 4, True),
+]
+
+
+def fixture_path(spec):
+    """Cache location of a fixture, keyed by everything that defines it"""
+    digest = hashlib.sha256(json.dumps(spec).encode()).hexdigest()[:12]
+    return os.path.join(FIXTURE_DIR, f"{spec[0]}_{digest}.mp4")
+
+
+def build_command(spec, output_path):
+    """ffmpeg arguments for one fixture: a moving test pattern and, optionally, a tone"""
+    name, width, height, fps, seconds, has_audio = spec
+    cmd = [FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error"]
+    cmd += ["-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={fps}:duration={seconds}"]
+    if has_audio:
+        cmd += ["-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={seconds}"]
+    cmd += ["-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p", "-g", str(fps * 2)]
+    if has_audio:
+        cmd += ["-c:a", "aac", "-ac", "2"]
+    cmd += ["-f", "mp4", output_path]
+    return cmd
+
+
+def ensure_fixtures(specs=FIXTURES):
+    """Generate any missing fixtures and return their paths"""
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    paths = []
+    for spec in specs:
+        path = fixture_path(spec)
+        if not os.path.exists(path):
+            tmp_path = path + ".part"
+            subprocess.run(build_command(spec, tmp_path), check=True, stdin=subprocess.DEVNULL)
+            os.replace(tmp_path, path)
+        paths.append(path)
+    return paths
@@ -0,0 +1,372 @@
+"""Benchmark the render pipeline on synthetic fixtures and compare with earlier runs.
+
+    python benchmarks/run.py --sizes 1 4 8 --backends ffmpeg segments --encoder-profiles draft standard
+
+Runs the app's own code paths (ingest, sequence generation, processed clips,
+batch render and ZIP packaging) against generated fixtures, reports throughput,
+latency per second of output and peak memory, saves the results as JSON and
+compares them with the previous run (or --compare FILE).
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import psutil
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import fixtures  # noqa: E402  (benchmarks/ is on the path when run as a script)
+
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+# Metrics where a larger value is a regression; the rest are better when larger
+LOWER_IS_BETTER = ("seconds", "latency_per_output_s", "peak_rss_mb", "mb_per_output_minute")
+HIGHER_IS_BETTER = ("mb_per_s", "fps", "output_s_per_wall_s", "videos_per_min")
+# Timings this short are mostly scheduler noise and never count as regressions
+NOISE_FLOOR_SECONDS = 0.05
+
+
+class UploadedFixture(io.BytesIO):
+    """Stands in for Streamlit's UploadedFile: the whole file in memory plus its name and ID"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            super().__init__(f.read())
+        self.name = os.path.basename(path)
+        self.file_id = path
+        self.size = len(self.getbuffer())
+
+
+class PeakMemory:
+    """Samples the RSS of this process and its children in the background while active"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        process = psutil.Process()
+        while True:
+            total = 0
+            for p in [process] + process.children(recursive=True):
+                try:
+                    total += p.memory_info().rss
+                except psutil.NoSuchProcess:
+                    continue
+            self.peak_bytes = max(self.peak_bytes, total)
+            if self._stop.wait(self.interval):
+                break
+
+    @property
+    def peak_mb(self):
+        return round(self.peak_bytes / (1024 * 1024), 1)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the render pipeline on synthetic fixtures")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 4, 8], help="Batch sizes (videos per batch)")
+    parser.add_argument("--backends", nargs="+", default=["ffmpeg", "segments"], help="Render backends to measure")
+    parser.add_argument("--encoder-profiles", nargs="+", default=["standard"], help="Encoder profiles to measure")
+    parser.add_argument("--workers", type=int, help="Parallel render workers (default: the app's default)")
+    parser.add_argument("--threads", type=int, help="Encoder threads per worker")
+    parser.add_argument("--seed", type=int, default=1234, help="Seed for sequence, timing and speed choices")
+    parser.add_argument("--font", help="Caption font file, for machines without the app's font")
+    parser.add_argument("--results-dir", default=RESULTS_DIR, help="Where result files are saved")
+    parser.add_argument("--compare", help="Result file to compare with (default: the latest in --results-dir)")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent change reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 on any regression")
+    return parser.parse_args(argv)
+
+
+def isolate_caches():
+    """Point every cache at a fresh directory so no run reuses another's work
+
+    Must run before the app modules are imported: they read these at import time.
+    """
+    work_dir = tempfile.mkdtemp(prefix="video_editor_bench_")
+    for variable, name in [
+        ("VIDEO_EDITOR_STORE_DIR", "uploads"),
+        ("VIDEO_EDITOR_SEGMENT_CACHE_DIR", "segments"),
+        ("VIDEO_EDITOR_OUTPUT_DIR", "outputs"),
+        ("VIDEO_EDITOR_JOBS_DIR", "jobs"),
+        ("VIDEO_EDITOR_ARCHIVE_DIR", "archives"),
+        ("VIDEO_EDITOR_PREVIEW_DIR", "previews"),
+        ("VIDEO_EDITOR_OVERLAY_DIR", "overlays"),
+    ]:
+        os.environ[variable] = os.path.join(work_dir, name)
+    return work_dir
+
+
+def environment():
+    """Versions and hardware a run was measured on"""
+    from moviepy.config import FFMPEG_BINARY
+    import moviepy
+
+    banner = subprocess.run([FFMPEG_BINARY, "-version"], capture_output=True, text=True).stdout.splitlines()
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "moviepy": moviepy.__version__,
+        "ffmpeg": banner[0] if banner else None,
+        "git_commit": commit or None,
+    }
+
+
+def bench_ingest(upload_store, engine, paths):
+    """store_upload and group_params over every fixture, split into two groups
+
+    The app's ingest step also queues preview proxies in the background; that is
+    left out so their transcodes do not run into the timings and memory of later phases.
+    """
+    files = [UploadedFixture(p) for p in paths]
+    half = (len(files) + 1) // 2
+    with PeakMemory() as memory:
+        started = time.perf_counter()
+        video_params = {
+            label: engine.group_params([upload_store.store_upload(f) for f in group])
+            for label, group in [("Hook", files[:half]), ("Body", files[half:])]
+        }
+        seconds = time.perf_counter() - started
+    megabytes = sum(f.size for f in files) / (1024 * 1024)
+    return video_params, {
+        "phase": "ingest",
+        "seconds": round(seconds, 4),
+        "mb_per_s": round(megabytes / seconds, 1),
+        "peak_rss_mb": memory.peak_mb,
+    }
+
+
+def bench_sequences(engine, video_params, count, seed):
+    """generate_sequences for one batch"""
+    started = time.perf_counter()
+    rows, generated = engine.generate_sequences(video_params, count, random.Random(seed))
+    return rows, generated, {"phase": "generate_sequences", "batch_size": count, "seconds": round(time.perf_counter() - started, 4)}
+
+
+def bench_processed_clip(moviepy_render, paths):
+    """create_processed_clip with a speed change and caption, every frame pulled through MoviePy"""
+    frames = 0
+    with PeakMemory() as memory:
+        started = time.perf_counter()
+        with moviepy_render.ReaderPool() as pool:
+            for path in paths:
+                clip = moviepy_render.create_processed_clip(path, (0.5, 2.5), 1.5, "Benchmark", pool)
+                for _ in clip.iter_frames(fps=30):
+                    frames += 1
+        seconds = time.perf_counter() - started
+    return {
+        "phase": "create_processed_clip",
+        "seconds": round(seconds, 4),
+        "fps": round(frames / seconds, 1),
+        "peak_rss_mb": memory.peak_mb,
+    }
+
+
+def configure_clips(engine, video_params, generated, count, rng):
+    """Fill in clip settings the way Step 3 does, as one line of text per clip"""
+    for label, data in video_params.items():
+        durations = [d for _, d in generated.get(label, [])]
+        data["timings"] = "\n".join(f"{s}, {e}" for s, e in (engine.random_timing(d, rng) for d in durations))
+        data["speeds"] = "\n".join(rng.choice(["1.0", "1.0", "1.5", "2.0"]) for _ in range(count))
+        data["texts"] = [f"{label} {i+1}" if i % 2 == 0 else "" for i in range(count)]
+
+
+def bench_batch(editor, jobs, profiling, st, pd, video_params, rows, count, backend, encoder_profile, workers, threads):
+    """create_combined_clips as one background job, then create_download_zip on the result"""
+    st.session_state["sequences_df"] = pd.DataFrame(rows)
+    group_clips = editor.engine.parse_all_clip_settings(video_params)
+    with PeakMemory() as memory:
+        started = time.perf_counter()
+        job_id = editor.create_combined_clips(
+            video_params, group_clips, count, backend, workers, threads,
+            {"reuse_outputs": False, "encoder_profile": encoder_profile},
+        )
+        job = jobs.get_job(job_id)
+        while job["status"] not in jobs.FINISHED_STATES:
+            time.sleep(0.1)
+            job = jobs.get_job(job_id)
+        seconds = time.perf_counter() - started
+    errors = [r["error"] for r in job["results"] if r["error"]]
+    rendered = len(job["results"]) - len(errors)
+    output_seconds = sum((r.get("profile") or {}).get("output_seconds", 0) for r in job["results"] if not r["error"])
+
+    package_started = time.perf_counter()
+    editor.create_download_zip(job)
+    package_seconds = time.perf_counter() - package_started
+
+    encoder = (profiling.encoder_rows(job["results"]) or [{}])[0]
+    for result in job["results"]:
+        if os.path.exists(result["output_path"]):
+            os.remove(result["output_path"])
+    return [
+        {
+            "phase": "create_combined_clips",
+            "backend": backend,
+            "encoder_profile": encoder_profile,
+            "batch_size": count,
+            "seconds": round(seconds, 4),
+            # Failed videos are fast and would read as a speedup, so only rendered ones count
+            "videos_per_min": round(rendered / seconds * 60, 2),
+            "output_s_per_wall_s": round(output_seconds / seconds, 3) if output_seconds else 0.0,
+            "latency_per_output_s": round(seconds / output_seconds, 3) if output_seconds else None,
+            "peak_rss_mb": memory.peak_mb,
+            "mb_per_output_minute": encoder.get("mb_per_output_minute"),
+            "errors": errors,
+            "stages": [
+                {"stage": s["stage"], "wall": round(s["wall"], 4), "cpu": round(s["cpu"], 4)}
+                for s in profiling.stage_totals(job["results"])
+            ],
+        },
+        {
+            "phase": "create_download_zip",
+            "backend": backend,
+            "encoder_profile": encoder_profile,
+            "batch_size": count,
+            # Entries are added while the batch renders; this is what is left when it finishes
+            "seconds": round(package_seconds, 4),
+            "in_job_seconds": round(sum(s["wall"] for s in profiling.stage_totals(job["results"]) if s["stage"] == profiling.PACKAGE), 4),
+        },
+    ]
+
+
+def result_key(entry):
+    return (entry["phase"], entry.get("backend"), entry.get("encoder_profile"), entry.get("batch_size"))
+
+
+def compare(previous, current, threshold):
+    """Print metric changes against an earlier run; returns the regressions found
+
+    Any phase with failed renders is a regression, whatever its timings.
+    """
+    before = {result_key(e): e for e in previous["results"]}
+    regressions = []
+    print(f"\nCompared with {previous['created']} ({previous['environment'].get('git_commit')}):")
+    for entry in current["results"]:
+        if entry.get("errors"):
+            label = " ".join(str(part) for part in result_key(entry) if part is not None)
+            print(f"  {label:<40} {len(entry['errors'])} failed render(s): {entry['errors'][0]}  REGRESSION")
+            regressions.append((label, "errors", len(entry["errors"])))
+        old = before.get(result_key(entry))
+        if old is None:
+            continue
+        for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            if not old.get(metric) or entry.get(metric) is None:
+                continue
+            change = (entry[metric] - old[metric]) / old[metric] * 100
+            worse = change > threshold if metric in LOWER_IS_BETTER else change < -threshold
+            if metric == "seconds" and max(old[metric], entry[metric]) < NOISE_FLOOR_SECONDS:
+                worse = False
+            label = " ".join(str(part) for part in result_key(entry) if part is not None)
+            flag = "  REGRESSION" if worse else ""
+            print(f"  {label:<40} {metric:<22} {old[metric]:>10} -> {entry[metric]:<10} ({change:+.1f}%){flag}")
+            if worse:
+                regressions.append((label, metric, change))
+    return regressions
+
+
+def latest_result(results_dir):
+    files = sorted(glob.glob(os.path.join(results_dir, "bench_*.json")))
+    return files[-1] if files else None
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    work_dir = isolate_caches()
+    if args.font:
+        # An environment variable, so spawned MoviePy workers pick it up too
+        os.environ["VIDEO_EDITOR_CAPTION_FONT"] = args.font
+
+    # Streamlit runs in bare mode here and warns on every call without a script context
+    os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+    # Imported only now so they pick up the isolated cache directories
+    import pandas as pd
+    import streamlit as st
+    import batch_render
+    import editor
+    import engine
+    import jobs
+    import moviepy_render
+    import overlays
+    import profiling
+    import upload_store
+
+    workers = args.workers or batch_render.DEFAULT_WORKERS
+    threads = args.threads or batch_render.default_threads(workers)
+    previous_path = args.compare or latest_result(args.results_dir)
+
+    print("Generating fixtures...", file=sys.stderr)
+    paths = fixtures.ensure_fixtures()
+
+    run = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment(),
+        "config": {"sizes": args.sizes, "backends": args.backends, "encoder_profiles": args.encoder_profiles, "workers": workers, "threads": threads, "seed": args.seed, "font": overlays.TEXT_STYLE["font"]},
+        "fixtures": [dict(zip(("name", "width", "height", "fps", "seconds", "has_audio"), spec)) for spec in fixtures.FIXTURES],
+        "results": [],
+    }
+    try:
+        video_params, entry = bench_ingest(upload_store, engine, paths)
+        run["results"].append(entry)
+        run["results"].append(bench_processed_clip(moviepy_render, paths))
+        for count in args.sizes:
+            rows, generated, entry = bench_sequences(engine, video_params, count, args.seed)
+            run["results"].append(entry)
+            configure_clips(engine, video_params, generated, count, random.Random(args.seed))
+            for backend in args.backends:
+                for encoder_profile in args.encoder_profiles:
+                    print(f"Rendering {count} video(s) with {backend} ({encoder_profile})...", file=sys.stderr)
+                    run["results"].extend(bench_batch(
+                        editor, jobs, profiling, st, pd, video_params, rows, count, backend, encoder_profile, workers, threads
+                    ))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for entry in run["results"]:
+        label = " ".join(str(part) for part in result_key(entry) if part is not None)
+        metrics = ", ".join(f"{k}={entry[k]}" for k in LOWER_IS_BETTER + HIGHER_IS_BETTER if entry.get(k) is not None)
+        if entry.get("errors"):
+            metrics += f", FAILED={len(entry['errors'])}"
+        print(f"{label:<40} {metrics}")
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    result_path = os.path.join(args.results_dir, f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(result_path, "w") as f:
+        json.dump(run, f, indent=2)
+    print(f"\nSaved {result_path}")
+
+    regressions = []
+    if previous_path:
+        with open(previous_path) as f:
+            regressions = compare(json.load(f), run, args.threshold)
+    failed = any(entry.get("errors") for entry in run["results"])
+    return 1 if (regressions or failed) and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
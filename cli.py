@@ -0,0 +1,77 @@
+"""Render a batch from a manifest without the Streamlit UI.
+
+    python cli.py manifest.json --output-dir renders/ --workers 4 --profile draft
+
+The manifest lists the groups (label, files, timings, speeds, texts) plus the
+count, seed, smart_selection, backend and render options (including
+encoder_profile); see engine.plan_manifest().
+"""
+import argparse
+import json
+import os
+import sys
+
+import encoder_profiles
+import engine
+import renderer
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Render combined videos from a JSON/YAML manifest")
+    parser.add_argument("manifest", help="Path to the JSON or YAML manifest")
+    parser.add_argument("-o", "--output-dir", default="renders", help="Where combined videos are written")
+    parser.add_argument("--results", help="Write the results document here (default: <output-dir>/results.json)")
+    parser.add_argument("--workers", type=int, help="Combined videos rendered at the same time")
+    parser.add_argument("--threads", type=int, help="Encoder threads per worker")
+    parser.add_argument("--backend", choices=list(renderer.BACKENDS), help="Render backend")
+    parser.add_argument("--profile", choices=list(encoder_profiles.PROFILES), help="Encoder profile (default: the manifest's, else standard)")
+    parser.add_argument("--count", type=int, help="Override the manifest's number of videos")
+    parser.add_argument("--seed", type=int, help="Override the manifest's random seed")
+    parser.add_argument("--force", action="store_true", help="Render every video even if an identical one was rendered before")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    manifest = engine.load_manifest(args.manifest)
+    if args.count is not None:
+        manifest["count"] = args.count
+    if args.seed is not None:
+        manifest["seed"] = args.seed
+    if args.force:
+        manifest.setdefault("options", {})["reuse_outputs"] = False
+    if args.profile:
+        manifest.setdefault("options", {})["encoder_profile"] = args.profile
+
+    def on_result(result, completed, total):
+        if result["error"]:
+            status = f"failed: {result['error']}"
+        elif result["reused"]:
+            status = "unchanged, reused"
+        else:
+            status = f"done in {result['seconds']:.1f}s ({result['backend']})"
+        print(f"[{completed}/{total}] Video {result['index'] + 1}: {status}", file=sys.stderr, flush=True)
+
+    # Relative file paths in the manifest are relative to the manifest itself
+    results = engine.run_manifest(
+        manifest,
+        args.output_dir,
+        base_dir=os.path.dirname(os.path.abspath(args.manifest)),
+        workers=args.workers,
+        threads=args.threads,
+        backend=args.backend,
+        on_result=on_result,
+    )
+    for problem in results["problems"]:
+        print(f"Warning: {problem}", file=sys.stderr)
+
+    # A file rather than stdout: MoviePy and ffmpeg may print to stdout while rendering
+    results_path = args.results or os.path.join(args.output_dir, "results.json")
+    with open(results_path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"{results['succeeded']} of {results['requested']} video(s) rendered, results in {results_path}", file=sys.stderr)
+    return 1 if results["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,23 @@
 import streamlit as st
-import tempfile
 import os
-import zipfile
+import json
 import random
 import time
 import pandas as pd
 # from pathlib import Path
-from moviepy import VideoFileClip, TextClip, CompositeVideoClip, video
+
+import batch_render
+import encoder_profiles
+import engine
+import jobs
+import mezzanine
+import packager
+import profiling
+import proxy
+import renderer
+import retention
+import segment_cache
+import upload_store
 
 # === App Configuration ===
 def initialize_app():
@@ -18,8 +29,6 @@ def initialize_app():
         st.session_state.upload_group_count = 2
     if "sequences_ready" not in st.session_state:
         st.session_state.sequences_ready = False
-    if "cancel_generation" not in st.session_state:
-        st.session_state.cancel_generation = False
 
 # === Video Upload Handling ===
 def handle_video_uploads():
@@ -43,6 +52,20 @@ def handle_video_uploads():
         step=1
     )
     
+    col1, col2 = st.columns(2)
+    with col1:
+        st.checkbox(
+            "Normalize uploads in the background", value=False, key="normalize_uploads",
+            help="Transcode each upload once to 1080x1920 at a constant frame rate with a short GOP. "
+                 "Renders then cut from this copy, which is faster and seek-accurate."
+        )
+    with col2:
+        st.checkbox(
+            "All-intra (every frame a keyframe)", value=False, key="normalize_all_intra",
+            disabled=not st.session_state.get("normalize_uploads"),
+            help="Larger files, but any cut point can be stream-copied"
+        )
+    
     video_inputs = []
     for i in range(st.session_state.upload_group_count):
         with st.expander(f"Group {i+1} Videos", expanded=i < 2):  # Only expand first two by default
@@ -64,37 +87,88 @@ def handle_video_uploads():
 def process_uploaded_videos(video_inputs):
     """Process uploaded videos and extract metadata"""
     video_params = {}
+    # Records survive reruns, so each upload is hashed, written and probed only once per session
+    upload_records = st.session_state.setdefault("upload_records", {})
+    normalize = st.session_state.get("normalize_uploads", False)
+    all_intra = st.session_state.get("normalize_all_intra", False)
     
     for label, files in video_inputs:
         if not files:
             continue
             
-        temp_paths = []
-        durations = []
+        records = []
         for file in files:
             st.write(f"Uploaded: {file.name}")
-            file.seek(0)
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as temp_vid:
-                temp_vid.write(file.read())
-                original_filename = os.path.basename(file.name) if hasattr(file, 'name') else os.path.basename(temp_vid.name)
-                temp_paths.append((temp_vid.name, original_filename))
+            cache_key = getattr(file, "file_id", None) or f"{file.name}:{file.size}"
+            record = upload_records.get(cache_key)
+            # Stored again if retention removed it since it was first uploaded
+            if record is None or not os.path.exists(record["path"]):
                 try:
-                    clip = VideoFileClip(temp_vid.name)
-                    durations.append(clip.duration)
-                    clip.close()
+                    record = upload_store.store_upload(file)
                 except Exception as e:
-                    st.error(f"Error processing {original_filename}: {str(e)}")
+                    st.error(f"Error processing {os.path.basename(file.name)}: {str(e)}")
                     continue
+                upload_records[cache_key] = record
+            records.append(record)
+        
+        if records:
+            ingest = [r["ingest"] for r in records]
+            total_mb = sum(i["bytes"] for i in ingest) / (1024 * 1024)
+            seconds = sum(i["seconds"] for i in ingest)
+            growth_mb = max(i.get("rss_growth_bytes", 0) for i in ingest) / (1024 * 1024)
+            rss_mb = max(i.get("peak_rss_bytes", 0) for i in ingest) / (1024 * 1024)
+            st.caption(
+                f"📥 Ingested {total_mb:.1f} MB in {seconds:.2f}s · "
+                f"memory +{growth_mb:.0f} MB while ingesting (peak RSS {rss_mb:.0f} MB)"
+            )
         
-        video_params[label] = {
-            "paths": [p[0] for p in temp_paths],
-            "filenames": [os.path.basename(p[1]) for p in temp_paths],
-            "durations": durations,
-        }
+        # Render from the normalized mezzanine of each upload once it is ready
+        if normalize and records:
+            for record in records:
+                mezzanine.request_mezzanine(record, all_intra)
+            show_normalization_progress(label, records, all_intra)
+        
+        video_params[label] = engine.group_params(records, normalize, all_intra)
+        # Small proxies are made in the background so previews are ready within seconds
+        for digest, path, metadata in zip(video_params[label]["hashes"], video_params[label]["paths"], video_params[label]["metadata"]):
+            proxy.request_proxy(digest, path, metadata)
     
     return video_params
 
+def show_normalization_progress(label, records, all_intra):
+    """Show a group's background normalization progress, polling until it is done"""
+    statuses = [mezzanine.mezzanine_status(r["hash"], all_intra) for r in records]
+    polling = any(s["state"] in (mezzanine.PENDING, mezzanine.RUNNING) for s in statuses)
+    st.fragment(normalization_status, run_every=2.0 if polling else None)(label, records, all_intra, polling)
+
+def normalization_status(label, records, all_intra, polling):
+    """Progress bar for one group's mezzanine transcodes"""
+    statuses = [mezzanine.mezzanine_status(r["hash"], all_intra) for r in records]
+    active = any(s["state"] in (mezzanine.PENDING, mezzanine.RUNNING) for s in statuses)
+    if polling and not active:
+        # Rerun the whole app so renders pick up the finished mezzanines
+        st.rerun()
+    
+    ready = sum(s["state"] == mezzanine.READY for s in statuses)
+    st.progress(
+        sum(s["progress"] for s in statuses) / len(statuses),
+        text=f"🧰 {label}: {ready} of {len(statuses)} video(s) normalized"
+    )
+    for record, status in zip(records, statuses):
+        if status["state"] == mezzanine.FAILED:
+            st.warning(f"Normalization failed for {record['filename']}, the original upload will be used: {status['error']}")
+            if st.button("Retry normalization", key=f"retry_{mezzanine.mezzanine_id(record['hash'], all_intra)}"):
+                mezzanine.retry_mezzanine(record, all_intra)
+                # Rerun the whole app so the progress bar starts polling again
+                st.rerun()
+
 # === Sequence Generation ===
+def use_seed():
+    """Generate button callback: remember the seed this generation uses and draw the next one"""
+    st.session_state["sequence_seed_used"] = st.session_state["sequence_seed"]
+    if not st.session_state.get("keep_seed"):
+        st.session_state["sequence_seed"] = random.randrange(2**31)
+
 def generate_sequences(video_params, num_videos_to_generate):
     """Generate random video sequences"""
     st.markdown("---")
@@ -104,36 +178,22 @@ def generate_sequences(video_params, num_videos_to_generate):
     col1, col2 = st.columns(2)
     with col1:
         auto_select = st.checkbox("Use smart video selection", value=True, 
-                                 help="When enabled, tries to select videos with similar dimensions and aspect ratios")
+                                 help="When enabled, favors videos with similar dimensions and frame rates, avoids near-duplicate shots and prefers videos that need no resizing")
     with col2:
         maintain_order = st.checkbox("Maintain group order", value=True,
                                     help="When enabled, clips will be sequenced in the same group order for each video")
+    if "sequence_seed" not in st.session_state:
+        st.session_state["sequence_seed"] = random.randrange(2**31)
+    st.number_input("Random seed", min_value=0, step=1, key="sequence_seed",
+                    help="The same seed and uploads always give the same sequences")
+    st.checkbox("Keep this seed", value=False, key="keep_seed",
+                            help="When disabled, a new seed is drawn after every generation. Enable it and enter an earlier seed to reproduce a batch")
     
-    if st.button("🧪 Generate Sequences"):
-        sequence_data = []
-        generated_sequences = {}
-
-        for i in range(num_videos_to_generate):
-            row = {"Sequence #": i+1}
-            for label, data in video_params.items():
-                if not data["paths"]:  # Skip empty groups
-                    continue
-                    
-                # Select a random video path
-                selected_path = random.choice(data["paths"])
-                try:
-                    with VideoFileClip(selected_path) as clip:
-                        duration = clip.duration
-                except Exception as e:
-                    st.error(f"Error reading video clip: {str(e)}")
-                    duration = 0
-                    
-                index = data["paths"].index(selected_path)
-                row[f"{label} File"] = data["filenames"][index]
-                row[f"{label} Duration"] = round(duration, 2)
-                generated_sequences.setdefault(label, []).append((selected_path, duration))
-                
-            sequence_data.append(row)
+    if st.button("🧪 Generate Sequences", on_click=use_seed):
+        # Picks read the metadata collected at upload, so no clip is reopened here
+        sequence_data, generated_sequences = engine.generate_sequences(
+            video_params, num_videos_to_generate, random.Random(st.session_state["sequence_seed_used"]), smart=auto_select
+        )
 
         df_sequences = pd.DataFrame(sequence_data)
         st.session_state["sequences_df"] = df_sequences
@@ -142,6 +202,8 @@ def generate_sequences(video_params, num_videos_to_generate):
     
     if "sequences_df" in st.session_state:
         with st.expander("🔍 View Generated Sequences", expanded=True):
+            if "sequence_seed_used" in st.session_state:
+                st.caption(f"🎲 Generated with seed {st.session_state['sequence_seed_used']}")
             st.dataframe(st.session_state["sequences_df"])
     
     # Check if sequences are ready
@@ -195,7 +257,7 @@ def setup_clip_settings(video_inputs, video_params, num_videos_to_generate):
             
             # Add button for randomizing speeds
             if st.button(f"🎲 Randomize {label} Speeds"):
-                randomized = [str(round(random.weibullvariate(1.6, 2), 2)) for _ in durations]
+                randomized = [str(engine.random_speed()) for _ in durations]
                 st.session_state[key_prefix + "speed_multipliers_text"] = "\n".join(randomized)
             
             st.markdown("---")
@@ -223,32 +285,16 @@ def initialize_timings(key_prefix, durations, num_videos_to_generate):
     """Initialize random timing values if not already set"""
     if (key_prefix + "clip_timings_text" not in st.session_state or 
             len(st.session_state[key_prefix + "clip_timings_text"].splitlines()) != num_videos_to_generate):
-        timings = []
-        for duration in durations:
-            if duration > 1:
-                start = round(random.uniform(0, duration - 1), 2)
-                end = round(random.uniform(start + 0.5, duration), 2)
-            else:
-                start = 0
-                end = duration
-            timings.append(f"{start}, {end}")
-        st.session_state[key_prefix + "clip_timings_text"] = "\n".join(timings)
+        timings = [engine.random_timing(duration) for duration in durations]
+        st.session_state[key_prefix + "clip_timings_text"] = "\n".join(f"{start}, {end}" for start, end in timings)
 
 def timing_buttons(key_prefix, label, durations):
     """Add buttons for timing operations"""
     col1, col2 = st.columns(2)
     with col1:
         if st.button(f"🎲 Randomize {label} Timings"):
-            randomized = []
-            for duration in durations:
-                if duration > 1:
-                    start = round(random.uniform(0, duration - 1), 2)
-                    end = round(random.uniform(start + 0.5, duration), 2)
-                else:
-                    start = 0
-                    end = duration
-                randomized.append(f"{start}, {end}")
-            st.session_state[key_prefix + "clip_timings_text"] = "\n".join(randomized)
+            randomized = [engine.random_timing(duration) for duration in durations]
+            st.session_state[key_prefix + "clip_timings_text"] = "\n".join(f"{start}, {end}" for start, end in randomized)
     with col2:
         if st.button(f"📏 Full-Length {label} Timings"):
             full_timings = [f"0.0, {duration}" for duration in durations]
@@ -269,219 +315,400 @@ def initialize_overlay_text(key_prefix, num_videos_to_generate):
         filled_lines = (existing_lines + [f"Clip {i+1}" for i in range(len(existing_lines), num_videos_to_generate)])[:num_videos_to_generate]
         st.session_state[key_prefix + "overlay_texts"] = "\n".join(filled_lines)
 
+# === Preview ===
+def preview_sequences(video_params, num_videos_to_generate):
+    """Render and show low-resolution previews of every sequence from the upload proxies"""
+    st.markdown("---")
+    st.subheader("👀 Preview Sequences")
+    st.caption(f"Quick {proxy.PROXY_SIZE[0]}x{proxy.PROXY_SIZE[1]} renders at {proxy.PROXY_FPS} fps to check timings, speeds and texts")
+    
+    if st.button("👀 Render Previews"):
+        group_clips = engine.parse_all_clip_settings(video_params)
+        rows = st.session_state["sequences_df"].to_dict("records")[:num_videos_to_generate]
+        with st.spinner("Rendering previews..."):
+            previews, problems = engine.render_previews(video_params, group_clips, rows)
+        for problem in problems:
+            st.error(problem)
+        st.session_state["previews"] = previews
+    
+    previews = st.session_state.get("previews", [])
+    if previews:
+        st.caption(f"⚡ Rendered {len(previews)} preview(s) in {sum(p['seconds'] for p in previews):.1f}s")
+    columns = st.columns(3)
+    for n, preview in enumerate(previews):
+        with columns[n % 3]:
+            st.markdown(f"**Video {preview['index']+1}**")
+            if preview["error"]:
+                st.error(f"Error rendering preview: {preview['error']}")
+            elif os.path.exists(preview["path"]):
+                st.video(preview["path"])
+
 # === Video Generation ===
 def generate_videos(video_params, num_videos_to_generate):
     """Generate the final video clips"""
     st.markdown("---")
     st.subheader("🎬 Step 4: Generate Videos")
     
+    backend = st.selectbox(
+        "Render backend",
+        options=list(renderer.BACKENDS),
+        index=list(renderer.BACKENDS).index(renderer.DEFAULT_BACKEND),
+        format_func=renderer.BACKEND_LABELS.get,
+        help="ffmpeg renders each video in a single native process and falls back to MoviePy on failure. "
+             "The segment cache encodes each unique clip once and reuses it across sequences and reruns."
+    )
+    render_options = {
+        "reuse_outputs": st.checkbox(
+            "Reuse unchanged videos", value=True,
+            help="Videos whose sources, timings, speeds, texts and render settings match an earlier render are not rendered again"
+        )
+    }
+    if backend == renderer.BACKEND_SEGMENTS:
+        cached_count, cached_bytes = segment_cache.cache_usage()
+        st.caption(f"🗃️ Segment cache: {cached_count} segment(s), {cached_bytes / (1024 * 1024):.1f} MB")
+        col1, col2 = st.columns(2)
+        with col1:
+            render_options["stream_copy"] = st.checkbox(
+                "Stream-copy eligible clips", value=True,
+                help="Clips at 1.0x with no overlay text from 1080x1920 H.264/AAC sources are cut without re-encoding"
+            )
+        with col2:
+            render_options["snap_to_keyframes"] = st.checkbox(
+                "Snap timings to keyframes", value=False,
+                disabled=not render_options["stream_copy"],
+                help="Move a clip's start to the nearest keyframe so more clips qualify for stream copy"
+            )
+    render_options["encoder_profile"] = st.selectbox(
+        "Encoder profile",
+        options=list(encoder_profiles.PROFILES),
+        index=list(encoder_profiles.PROFILES).index(encoder_profiles.DEFAULT_PROFILE),
+        format_func=lambda name: encoder_profiles.PROFILES[name]["label"],
+        help="x264 preset, quality and audio bitrate. Draft renders fastest for review; archival is slowest and largest"
+    )
+    measured = st.session_state.get("encoder_stats")
+    if measured:
+        st.caption("Measured on this server in earlier batches:")
+        st.dataframe(pd.DataFrame(list(measured.values())), hide_index=True)
+    # Fast presets run more videos with fewer threads each; slow ones the other way round.
+    # Batches render side by side, so each plans for its share of the cores
+    cores = jobs.core_budget()
+    planned_workers, _ = encoder_profiles.plan_parallelism(render_options["encoder_profile"], cores)
+    col1, col2 = st.columns(2)
+    with col1:
+        workers = st.number_input(
+            "Parallel render workers",
+            min_value=1,
+            max_value=batch_render.CPU_COUNT,
+            value=planned_workers,
+            step=1,
+            help="How many combined videos are rendered at the same time"
+        )
+    with col2:
+        threads = st.number_input(
+            "Encoder threads per worker",
+            min_value=1,
+            max_value=batch_render.CPU_COUNT,
+            value=max(1, cores // workers),
+            step=1,
+            help="ffmpeg thread budget for each worker; workers × threads should not exceed your core count"
+        )
+    if cores < batch_render.CPU_COUNT:
+        st.caption(f"Other batches are rendering, so this one is planned for {cores} of the {batch_render.CPU_COUNT} cores")
+    if workers * threads > cores:
+        st.warning(f"⚠️ {workers} workers × {threads} threads is more than the {cores} cores available; encoders will compete for CPU.")
+    delivery = st.selectbox(
+        "Deliver videos as",
+        options=list(packager.DELIVERY_LABELS),
+        format_func=packager.DELIVERY_LABELS.get,
+        help="Large batches can skip the archive and download videos one at a time, or just a manifest of where they are on the server"
+    )
+    
     if st.button("🚀 Generate All Combined Clips"):
-        if st.session_state.get("cancel_generation", False):
-            st.warning("🚫 Generation canceled.")
-            return
-            
-        cancel_button = st.button("🛑 Cancel Generation")
-        if cancel_button:
-            st.session_state.cancel_generation = True
-            return
-
-        # Set up progress tracking
-        status_text = st.empty()
-        eta_text = st.empty()
-        progress_bar = st.progress(0)
-        start_time = time.time()
-        
         # Parse clip settings for each group
-        group_clips = parse_all_clip_settings(video_params)
+        group_clips = engine.parse_all_clip_settings(video_params)
         
-        # Generate and combine clips
-        combined_output_files = create_combined_clips(
+        # Queue the batch; it renders in the background and is tracked in the sidebar
+        job_id = create_combined_clips(
             video_params, 
             group_clips, 
             num_videos_to_generate, 
-            status_text, 
-            eta_text, 
-            progress_bar, 
-            start_time
+            backend,
+            workers,
+            threads,
+            render_options,
+            delivery
         )
-        
-        # Create downloadable zip file
-        if combined_output_files:
-            create_download_zip(combined_output_files)
-            
-            progress_bar.progress(1.0)
-            st.success(f"✅ Successfully generated {len(combined_output_files)} combined clip(s)!")
-            st.session_state.cancel_generation = False
-
-def parse_all_clip_settings(video_params):
-    """Parse timing, speed, and text settings for all groups"""
-    group_clips = {}
-    for label, data in video_params.items():
-        timings, speeds, texts = parse_clip_settings(data)
-        group_clips[label] = {
-            "timings": timings,
-            "speeds": speeds,
-            "texts": texts
-        }
-    return group_clips
-
-def parse_clip_settings(data):
-    """Parse timing, speed, and text settings from text areas"""
-    timings = []
-    for line in data["timings"].splitlines():
-        try:
-            start_str, end_str = line.split(",")
-            timings.append((float(start_str.strip()), float(end_str.strip())))
-        except (ValueError, AttributeError):
-            # Default to (0,0) for invalid entries
-            timings.append((0.0, 0.0))
-    
-    speeds = []
-    for x in data["speeds"].splitlines():
-        try:
-            speeds.append(float(x.strip()))
-        except (ValueError, AttributeError):
-            speeds.append(1.0)  # Default speed
-    
-    texts = data["texts"]
-    return timings, speeds, texts
+        if job_id:
+            st.session_state["render_job_id"] = job_id
+            st.query_params["job"] = job_id
+            # Rerun so the sidebar picks up the new job
+            st.rerun()
 
-def create_combined_clips(video_params, group_clips, num_videos_to_generate, status_text, eta_text, progress_bar, start_time):
-    """Create the combined video clips"""
-    combined_output_files = []
+def create_combined_clips(video_params, group_clips, num_videos_to_generate, backend=renderer.DEFAULT_BACKEND, workers=batch_render.DEFAULT_WORKERS, threads=None, render_options=None, delivery=packager.DELIVERY_ZIP):
+    """Resolve every combined video and submit them as one background render job"""
+    rows = st.session_state["sequences_df"].to_dict("records")[:num_videos_to_generate]
+    # Videos are written to the job's workspace, which retention cleans up with the job
+    job_id = jobs.new_job_id()
+    render_jobs, problems = engine.build_render_jobs(
+        video_params,
+        group_clips,
+        rows,
+        lambda i: jobs.output_path(job_id, i),
+        backend,
+        threads,
+        render_options,
+    )
+    for problem in problems:
+        st.error(problem)
+    for job in render_jobs:
+        show_round_details(job["index"], job["segments"])
 
-    for i in range(num_videos_to_generate):
-        if st.session_state.get("cancel_generation", False):
-            status_text.error("🚫 Canceled by user.")
-            break
-            
-        # Update progress indicators
-        elapsed = time.time() - start_time
-        avg_time = elapsed / (i + 1) if i > 0 else 0
-        remaining = avg_time * (num_videos_to_generate - (i + 1))
-        
-        eta_text.markdown(f"⏱️ Estimated time remaining: **{int(remaining)}s**")
-        progress_bar.progress(i / num_videos_to_generate)
-        status_text.markdown(f"⏳ Generating video {i+1} of {num_videos_to_generate}...")
-        
-        # Process clips for this round
-        clips_for_this_round = process_clips_for_round(i, video_params, group_clips)
-        
-        if not clips_for_this_round:
-            st.error(f"No valid clips found for round {i+1}")
-            continue
-            
-        # Combine clips and save
-        try:
-            final_combined = video.compositing.CompositeVideoClip.concatenate_videoclips(clips_for_this_round)
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f"_combined_{i+1}.mp4") as temp_output:
-                final_combined.write_videofile(temp_output.name, codec="libx264", audio_codec="aac")
-                combined_output_files.append(temp_output.name)
-        except Exception as e:
-            st.error(f"Error generating combined video {i+1}: {str(e)}")
-            
-    return combined_output_files
+    if not render_jobs:
+        return None
+    job_id = jobs.submit_job(render_jobs, workers, delivery, job_id)
+    # Make room for the new batch; once submitted, its sources and outputs count as in use
+    retention.enforce()
+    return job_id
 
-def process_clips_for_round(i, video_params, group_clips):
-    """Process clips from each group for this round"""
-    clips_for_this_round = []
-    
-    # Create a status expander for detailed logs
+def show_round_details(i, segments):
+    """Log the clip resolved from each group for one combined video"""
     with st.expander(f"Processing details for video {i+1}", expanded=False):
-        for label, data in video_params.items():
-            if label not in group_clips:
-                continue
-                
-            params = group_clips[label]
-            
-            # Skip if we don't have enough parameters
-            if i >= len(params["timings"]) or i >= len(params["speeds"]):
-                st.warning(f"Missing timing or speed parameters for {label} in round {i+1}")
-                continue
-                
-            timing = params["timings"][i]
-            speed = params["speeds"][i]
-            text = params["texts"][i] if i < len(params["texts"]) else ""
-            
-            # Get selected file from sequences_df
-            try:
-                selected_filename = st.session_state["sequences_df"].iloc[i][f"{label} File"]
-                st.write(f"Processing: Sequence {i+1} | {label} File")
-                st.write(f"→ {selected_filename}")
-                st.write(f"  ⤷ Timing: {timing[0]}s to {timing[1]}s")
-                st.write(f"  ⤷ Speed: {speed}x")
-                st.write(f"  ⤷ Text: '{text}'")
-                
-                path_index = data["filenames"].index(selected_filename)
-                selected_path = data["paths"][path_index]
-                
-                clip = create_processed_clip(selected_path, timing, speed, text, label, i)
-                if clip:
-                    clips_for_this_round.append(clip)
-                    st.success(f"✅ Successfully processed clip for {label}")
-                    
-            except (ValueError, IndexError, KeyError) as e:
-                st.error(f"Error finding file for {label} in round {i+1}: {str(e)}")
-                continue
-                
-    return clips_for_this_round
-
-def create_processed_clip(video_path, timing, speed, text, label, clip_index):
-    """Create a processed video clip with timing, speed, and text overlay"""
+        for segment in segments:
+            st.write(f"Processing: Sequence {i+1} | {segment['label']} File")
+            st.write(f"→ {segment['filename']}")
+            st.write(f"  ⤷ Timing: {segment['start']}s to {segment['end']}s")
+            st.write(f"  ⤷ Speed: {segment['speed']}x")
+            st.write(f"  ⤷ Text: '{segment['text']}'")
+
+def show_downloads(job):
+    """Offer a finished job's videos the way the batch was set up to deliver them"""
+    delivery = job.get("delivery", packager.DELIVERY_ZIP)
     try:
-        clip = VideoFileClip(video_path)
-        end_time = min(timing[1], clip.duration - 0.01)
-        base_clip = clip.subclipped(timing[0], end_time).with_effects([video.fx.Resize([1080,1920])])
-        
-        if speed != 1.0:
-            base_clip = base_clip.with_duration(base_clip.duration / speed)
-        
-        if text.strip():
-            txt_overlay = TextClip(
-                font="Mark Simonson - Proxima Nova Semibold-webfont",
-                text=text.strip(),
-                font_size=60,
-                color='white',
-                stroke_color="black",
-                stroke_width=5,
-                duration=base_clip.duration,
-                margin=(5,5),
-                method='caption',
-                size=(round(base_clip.size[0] * 0.8), None),
-                text_align='center'
-            ).with_position(("center", 225))
-            final_clip = CompositeVideoClip([base_clip, txt_overlay])
-        else:
-            final_clip = base_clip
-            
-        return final_clip
-        
+        if delivery == packager.DELIVERY_ZIP:
+            create_download_zip(job)
+        elif delivery == packager.DELIVERY_FILES:
+            create_file_download(job)
+        # The manifest is tiny, so it is always offered
+        st.download_button(
+            label="🧾 Download Manifest (JSON)",
+            data=packager.manifest_json(job["results"]),
+            file_name="combined_clips.json",
+            mime="application/json",
+            key=f"manifest_{job['id']}"
+        )
     except Exception as e:
-        st.error(f"Error processing {label} clip {clip_index+1}: {str(e)}")
-        return None
+        st.error(f"Error preparing downloads: {str(e)}")
 
-def create_download_zip(output_files):
-    """Create a downloadable ZIP file with all generated videos"""
-    try:
-        zip_path = tempfile.NamedTemporaryFile(delete=False, suffix=".zip").name
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            for file_path in output_files:
-                zipf.write(file_path, arcname=os.path.basename(file_path))
+def clear_prepared_download():
+    """Download button callback: let the file go once the browser has fetched it"""
+    st.session_state.pop("prepared_download", None)
 
-        with open(zip_path, "rb") as f:
+def offer_download(key, label, path, file_name, mime):
+    """Load a file for a browser download only after an explicit click
+
+    Streamlit reads download data into server memory on every rerun, so only one
+    prepared file per session is held, and only until it is downloaded.
+    """
+    size = os.path.getsize(path)
+    if size > packager.MAX_DOWNLOAD_BYTES:
+        st.info(f"📦 {file_name} is {size / (1024 ** 2):.0f} MB, too large to download through the browser. It is on the server at `{path}`.")
+        return
+    if st.session_state.get("prepared_download") != key:
+        if not st.button(f"📦 Prepare {label} ({size / (1024 ** 2):.0f} MB)", key=f"prepare_{key}"):
+            return
+        st.session_state["prepared_download"] = key
+    with open(path, "rb") as f:
+        st.download_button(
+            label=f"⬇️ Download {label}",
+            data=f,
+            file_name=file_name,
+            mime=mime,
+            key=f"download_{key}",
+            on_click=clear_prepared_download,
+        )
+
+def create_download_zip(job):
+    """Offer the job's ZIP archive, whose stored entries were added as videos finished"""
+    zip_path = job.get("archive") or packager.archive_path(job["id"])
+    # Only fills in videos that are missing, e.g. for jobs from before a server restart
+    packager.build_archive(zip_path, job["results"])
+    offer_download(f"zip_{job['id']}", "All Combined Clips (ZIP)", zip_path, "combined_clips.zip", "application/zip")
+
+def create_file_download(job):
+    """Offer one finished video at a time, so only that file is loaded for the download"""
+    finished = {
+        packager.output_name(r): r["output_path"]
+        for r in sorted(job["results"], key=lambda r: r["index"])
+        if not r["error"] and os.path.exists(r["output_path"])
+    }
+    if not finished:
+        return
+    name = st.selectbox("Video", options=list(finished), key=f"file_{job['id']}")
+    offer_download(f"file_{job['id']}_{name}", name, finished[name], name, "video/mp4")
+
+# === Render Job Status ===
+def show_render_job():
+    """Show the session's background render job in the sidebar"""
+    # The job ID is also kept in the URL so a reloaded page reconnects to it
+    job_id = st.session_state.get("render_job_id") or st.query_params.get("job")
+    if not job_id:
+        return
+    job = jobs.get_job(job_id)
+    if job is None:
+        clear_render_job()
+        return
+    st.session_state["render_job_id"] = job_id
+    
+    with st.sidebar:
+        st.subheader("🎬 Render Job")
+        st.caption(f"Job ID: `{job_id}`")
+        polling = job["status"] not in jobs.FINISHED_STATES
+        st.fragment(render_job_status, run_every=1.0 if polling else None)(job_id, polling)
+
+def render_job_status(job_id, polling):
+    """Display progress, partial results and controls for a render job"""
+    job = jobs.get_job(job_id)
+    if job is None:
+        return
+    if polling and job["status"] in jobs.FINISHED_STATES:
+        # Rerun the whole app once so this panel stops polling
+        st.rerun()
+    
+    total = max(job["total"], 1)
+    st.progress(job["completed"] / total)
+    st.markdown(f"**{job['status'].capitalize()}** · {job['completed']} of {job['total']} videos finished")
+    
+    if job["status"] == jobs.RUNNING and job["completed"]:
+        # Measured seconds of output per second of render; averages only until a video has been profiled
+        remaining = profiling.estimate_remaining(job["results"], job.get("planned_output_seconds", []), job["workers"])
+        if remaining is None:
+            elapsed = time.time() - job["started"]
+            remaining = elapsed / job["completed"] * (job["total"] - job["completed"])
+        st.markdown(f"⏱️ Estimated time remaining: **{int(remaining)}s**")
+    elif job["status"] == jobs.QUEUED:
+        st.info("⏳ Waiting for a free render slot...")
+    
+    # Sampled in the rendering process after each video; should stay flat over a long batch
+    sampled = [r["resources"] for r in job["results"] if r.get("resources")]
+    if sampled:
+        latest = sampled[-1]
+        st.caption(
+            f"🧮 After last video: {latest['open_handles']} open handles · "
+            f"{latest['child_processes']} child processes · RSS {latest['rss_bytes'] / (1024 * 1024):.0f} MB "
+            f"(peak {max(s['rss_bytes'] for s in sampled) / (1024 * 1024):.0f} MB)"
+        )
+    show_render_stats(job)
+    
+    for result in job["results"]:
+        if result["error"] and not result["canceled"]:
+            st.error(f"Error generating combined video {result['index']+1}: {result['error']}")
+        elif result.get("fallback") and not result.get("reused"):
+            st.warning(f"Combined video {result['index']+1} was rendered with MoviePy because the ffmpeg render failed (see the server log)")
+    if job["error"]:
+        st.error(f"Render job failed: {job['error']}")
+    
+    if job["status"] not in jobs.FINISHED_STATES:
+        if st.button("🛑 Cancel Generation", key=f"cancel_{job_id}"):
+            jobs.cancel_job(job_id)
+        return
+    
+    output_files = [
+        r["output_path"] for r in sorted(job["results"], key=lambda r: r["index"])
+        if not r["error"] and os.path.exists(r["output_path"])
+    ]
+    reused = sum(1 for r in job["results"] if r.get("reused") and not r["error"])
+    if reused:
+        st.caption(f"♻️ {reused} unchanged video(s) reused from earlier renders")
+    if job["status"] == jobs.COMPLETED:
+        st.success(f"✅ Successfully generated {len(output_files)} combined clip(s)!")
+    elif job["status"] == jobs.CANCELED:
+        st.warning(f"🚫 Canceled by user. {len(output_files)} video(s) finished before canceling.")
+    elif job["status"] == jobs.INTERRUPTED:
+        st.warning(f"⚠️ The server restarted during this job. {len(output_files)} video(s) had finished.")
+    if jobs.can_resume(job):
+        if st.button("▶️ Resume", key=f"resume_{job_id}",
+                     help="Render only the videos that have not finished; finished ones are kept"):
+            if jobs.resume_job(job_id):
+                st.rerun()
+            st.error("This job cannot be resumed: its plan is no longer on the server.")
+    if output_files:
+        show_downloads(job)
+    if st.button("🧹 Dismiss", key=f"dismiss_{job_id}"):
+        clear_render_job()
+        st.rerun()
+
+def show_render_stats(job):
+    """Expandable per-video and per-stage timings, exportable as JSON or CSV"""
+    video_rows = profiling.video_rows(job["results"])
+    if not video_rows:
+        return
+    encoder_rows = profiling.encoder_rows(job["results"])
+    if job["status"] in jobs.FINISHED_STATES:
+        # Remembered so the encoder profile choice can be made from measured numbers
+        stats = st.session_state.setdefault("encoder_stats", {})
+        for row in encoder_rows:
+            stats[row["encoder_profile"]] = row
+    with st.expander("📊 Render stats", expanded=False):
+        if encoder_rows:
+            st.dataframe(pd.DataFrame(encoder_rows), hide_index=True)
+        st.dataframe(pd.DataFrame(video_rows), hide_index=True)
+        totals = pd.DataFrame(profiling.stage_totals(job["results"]))
+        totals["share"] = (totals["share"] * 100).round(1).astype(str) + "%"
+        st.dataframe(totals.round(3), hide_index=True)
+        
+        col1, col2 = st.columns(2)
+        with col1:
             st.download_button(
-                label="⬇️ Download All Combined Clips (ZIP)",
-                data=f,
-                file_name="combined_clips.zip",
-                mime="application/zip"
+                label="⬇️ JSON",
+                data=json.dumps([
+                    {"video": r["index"] + 1, "backend": r["backend"], "reused": r.get("reused", False), "profile": r.get("profile")}
+                    for r in sorted(job["results"], key=lambda r: r["index"])
+                ], indent=2),
+                file_name=f"render_stats_{job['id']}.json",
+                mime="application/json",
+                key=f"stats_json_{job['id']}"
             )
-    except Exception as e:
-        st.error(f"Error creating ZIP file: {str(e)}")
+        with col2:
+            st.download_button(
+                label="⬇️ CSV",
+                data=pd.DataFrame(profiling.stage_rows(job["results"])).to_csv(index=False),
+                file_name=f"render_stats_{job['id']}.csv",
+                mime="text/csv",
+                key=f"stats_csv_{job['id']}"
+            )
+
+# === Storage ===
+def show_storage():
+    """Disk used by uploads, caches, job workspaces and archives, with a cleanup button"""
+    with st.sidebar.expander("🗄️ Storage", expanded=False):
+        rows = retention.usage()
+        st.dataframe(pd.DataFrame([
+            {
+                "area": row["area"],
+                "items": row["items"],
+                "MB": round(row["bytes"] / (1024 * 1024), 1),
+                "quota MB": round(row["quota_bytes"] / (1024 * 1024)),
+            }
+            for row in rows
+        ]), hide_index=True)
+        total, free = retention.disk_free()
+        st.caption(f"💽 {free / (1024 ** 3):.1f} GB free of {total / (1024 ** 3):.1f} GB · items unused for {retention.MAX_AGE_DAYS:g} days are removed")
+        if st.button("🧹 Clean up now", help="Apply age limits and quotas now; running jobs are never touched"):
+            freed = retention.enforce()
+            st.success(f"Freed {freed / (1024 * 1024):.1f} MB")
+
+def clear_render_job():
+    """Forget the session's render job"""
+    st.session_state.pop("render_job_id", None)
+    if "job" in st.query_params:
+        del st.query_params["job"]
 
 
 # === Main Application ===
 def main():
     initialize_app()
+    show_render_job()
+    show_storage()
     
     # Step 1: Handle video uploads
     video_inputs, num_videos_to_generate = handle_video_uploads()
@@ -495,6 +722,9 @@ def main():
     # Step 3: Set up clip settings
     setup_clip_settings(video_inputs, video_params, num_videos_to_generate)
     
+    # Optional: check the sequences at low resolution before the full render
+    preview_sequences(video_params, num_videos_to_generate)
+    
     # Step 4: Generate videos
     generate_videos(video_params, num_videos_to_generate)
 
@@ -0,0 +1,114 @@
+"""Named x264/AAC encoder profiles shared by every render backend.
+
+A profile fixes the x264 preset, CRF, tune and GOP length plus the AAC bitrate,
+so a batch can trade quality for speed (draft) or the other way round
+(archival). Profiles can be changed or added with a JSON file named by
+VIDEO_EDITOR_ENCODER_PROFILES, e.g. {"draft": {"crf": 30}}.
+"""
+import json
+import os
+
+PROFILES = {
+    "draft": {
+        "label": "Draft (fastest, lower quality)",
+        "preset": "ultrafast",
+        "crf": 28,
+        "tune": "fastdecode",
+        "gop_seconds": 2,
+        "audio_bitrate": "96k",
+        # Fast presets barely scale with threads: more videos at once, fewer threads each
+        "threads_per_worker": 1,
+    },
+    "standard": {
+        "label": "Standard",
+        "preset": "medium",
+        "crf": 23,
+        "tune": None,
+        "gop_seconds": None,
+        "audio_bitrate": "128k",
+        "threads_per_worker": 2,
+    },
+    "archival": {
+        "label": "Archival (slowest, highest quality)",
+        "preset": "slow",
+        "crf": 18,
+        "tune": "film",
+        "gop_seconds": None,
+        "audio_bitrate": "192k",
+        # Slow presets scale well with threads: fewer videos at once, more threads each
+        "threads_per_worker": 4,
+    },
+}
+DEFAULT_PROFILE = os.environ.get("VIDEO_EDITOR_ENCODER_PROFILE", "standard")
+# Encoder settings only; the rest of a profile is about scheduling
+ENCODER_SETTINGS = ("preset", "crf", "tune", "gop_seconds", "audio_bitrate")
+
+
+def _load_overrides():
+    """Merge profiles from the JSON file named by VIDEO_EDITOR_ENCODER_PROFILES"""
+    path = os.environ.get("VIDEO_EDITOR_ENCODER_PROFILES")
+    if not path:
+        return
+    with open(path) as f:
+        for name, settings in json.load(f).items():
+            base = PROFILES.get(name) or dict(PROFILES["standard"], label=name.capitalize())
+            PROFILES[name] = dict(base, **settings)
+
+
+_load_overrides()
+
+
+def get_profile(name=None):
+    """Settings of a profile by name (the default profile when name is None)"""
+    name = name or DEFAULT_PROFILE
+    if name not in PROFILES:
+        raise ValueError(f"Unknown encoder profile: {name}")
+    return PROFILES[name]
+
+
+def profile_name(options):
+    """The encoder profile a set of render options asks for"""
+    return (options or {}).get("encoder_profile") or DEFAULT_PROFILE
+
+
+def encoder_settings(options):
+    """What a profile changes in the encoded file (used in cache keys)"""
+    profile = get_profile(profile_name(options))
+    return {key: profile[key] for key in ENCODER_SETTINGS}
+
+
+def video_args(options, fps):
+    """x264 arguments for a profile"""
+    profile = get_profile(profile_name(options))
+    args = ["-preset", profile["preset"], "-crf", str(profile["crf"])]
+    if profile["tune"]:
+        args += ["-tune", profile["tune"]]
+    if profile["gop_seconds"]:
+        args += ["-g", str(max(1, round(profile["gop_seconds"] * fps)))]
+    return args
+
+
+def audio_args(options):
+    """AAC arguments for a profile"""
+    return ["-b:a", get_profile(profile_name(options))["audio_bitrate"]]
+
+
+def moviepy_args(options, fps):
+    """The same settings as keyword arguments for MoviePy's write_videofile"""
+    args = video_args(options, fps)
+    return {
+        "preset": args[1],
+        "ffmpeg_params": args[2:],
+        "audio_bitrate": get_profile(profile_name(options))["audio_bitrate"],
+    }
+
+
+def plan_parallelism(name, cpu_count, workers=None):
+    """(workers, threads per worker) that fill the machine's cores without oversubscribing them
+
+    With workers given, the cores are split between them instead.
+    """
+    if workers:
+        return workers, max(1, cpu_count // workers)
+    threads = max(1, min(get_profile(name)["threads_per_worker"], cpu_count))
+    return max(1, cpu_count // threads), threads
@@ -0,0 +1,366 @@
+"""UI-independent editing pipeline shared by the Streamlit app and the batch CLI.
+
+Nothing in here touches Streamlit: problems are returned as messages or raised,
+and the caller decides how to show them.
+"""
+import json
+import os
+import random
+import time
+
+import batch_render
+import encoder_profiles
+import mezzanine
+import profiling
+import proxy
+import renderer
+import selection
+import upload_store
+
+try:
+    import yaml
+except ImportError:  # YAML manifests are optional
+    yaml = None
+
+
+# === Ingest ===
+def ingest_files(paths, normalize=False, all_intra=False, poll_interval=0.5, max_wait=None):
+    """Store local video files and return their upload records
+
+    With normalize, waits for each file's mezzanine (at most max_wait seconds,
+    by default as long as the files' transcodes may run one after another) and
+    renders from it. Files whose mezzanine is not ready by then use the upload.
+    """
+    records = []
+    for path in paths:
+        with open(path, "rb") as f:
+            records.append(upload_store.store_upload(f))
+    if normalize:
+        for record in records:
+            mezzanine.request_mezzanine(record, all_intra)
+        if max_wait is None:
+            max_wait = mezzanine.TIMEOUT_SECONDS * len(records)
+        deadline = time.monotonic() + max_wait
+        while any(mezzanine.mezzanine_status(r["hash"], all_intra)["state"] in (mezzanine.PENDING, mezzanine.RUNNING) for r in records):
+            if time.monotonic() > deadline:
+                break
+            time.sleep(poll_interval)
+    return records
+
+
+def group_params(records, normalize=False, all_intra=False):
+    """Build one group's entry of video_params from its upload records"""
+    if normalize:
+        sources = [mezzanine.resolve(r, all_intra) for r in records]
+    else:
+        sources = [(r["hash"], r["path"], r["metadata"]) for r in records]
+    return {
+        "paths": [path for _, path, _ in sources],
+        "filenames": [r["filename"] for r in records],
+        "durations": [r["metadata"]["duration"] for r in records],
+        "hashes": [digest for digest, _, _ in sources],
+        "metadata": [metadata for _, _, metadata in sources],
+        # Of the upload itself: a normalized copy shows the same picture
+        "thumbnail_hashes": [r.get("thumbnail_hash") for r in records],
+    }
+
+
+# === Sequence Generation ===
+def generate_sequences(video_params, num_videos_to_generate, rng=random, smart=False):
+    """Pick one source per group for every combined video
+
+    Returns (rows, generated_sequences): rows are the table shown to the user
+    ("Sequence #", "<label> File", "<label> Duration"), generated_sequences maps
+    each label to the (path, duration) picked for every sequence. With smart,
+    picks come from the metadata index (see selection.py) instead of uniformly
+    at random.
+    """
+    if smart:
+        choices = selection.select_sequences(selection.build_index(video_params), num_videos_to_generate, rng)
+    else:
+        choices = [
+            {label: rng.randrange(len(data["paths"])) for label, data in video_params.items() if data["paths"]}
+            for _ in range(num_videos_to_generate)
+        ]
+    sequence_data = []
+    generated_sequences = {}
+    for i, choice in enumerate(choices):
+        row = {"Sequence #": i+1}
+        for label, index in choice.items():
+            data = video_params[label]
+            duration = data["durations"][index]
+            row[f"{label} File"] = data["filenames"][index]
+            row[f"{label} Duration"] = round(duration, 2)
+            generated_sequences.setdefault(label, []).append((data["paths"][index], duration))
+        sequence_data.append(row)
+    return sequence_data, generated_sequences
+
+
+def random_timing(duration, rng=random):
+    """A random (start, end) window of at least half a second inside a clip"""
+    if duration > 1:
+        start = round(rng.uniform(0, duration - 1), 2)
+        end = round(rng.uniform(start + 0.5, duration), 2)
+    else:
+        start = 0
+        end = duration
+    return start, end
+
+
+def random_speed(rng=random):
+    """A random speed multiplier, mostly between 1x and 2x"""
+    return round(rng.weibullvariate(1.6, 2), 2)
+
+
+# === Clip Settings ===
+def parse_all_clip_settings(video_params):
+    """Parse timing, speed, and text settings for all groups"""
+    group_clips = {}
+    for label, data in video_params.items():
+        timings, speeds, texts = parse_clip_settings(data)
+        group_clips[label] = {
+            "timings": timings,
+            "speeds": speeds,
+            "texts": texts
+        }
+    return group_clips
+
+
+def parse_clip_settings(data):
+    """Parse timing, speed, and text settings from their one-line-per-clip text form"""
+    timings = []
+    for line in data["timings"].splitlines():
+        try:
+            start_str, end_str = line.split(",")
+            timings.append((float(start_str.strip()), float(end_str.strip())))
+        except (ValueError, AttributeError):
+            # Default to (0,0) for invalid entries
+            timings.append((0.0, 0.0))
+
+    speeds = []
+    for x in data["speeds"].splitlines():
+        try:
+            speeds.append(float(x.strip()))
+        except (ValueError, AttributeError):
+            speeds.append(1.0)  # Default speed
+
+    texts = data["texts"]
+    return timings, speeds, texts
+
+
+# === Render Planning ===
+def resolve_round(i, video_params, group_clips, row):
+    """Resolve the segment (source, timing, speed, text) from each group for sequence i
+
+    Returns (segments, problems); problems are human-readable messages for
+    groups that had to be skipped.
+    """
+    segments = []
+    problems = []
+    for label, data in video_params.items():
+        if label not in group_clips:
+            continue
+        params = group_clips[label]
+
+        # Skip if we don't have enough parameters
+        if i >= len(params["timings"]) or i >= len(params["speeds"]):
+            problems.append(f"Missing timing or speed parameters for {label} in round {i+1}")
+            continue
+
+        timing = params["timings"][i]
+        try:
+            path_index = data["filenames"].index(row[f"{label} File"])
+        except (ValueError, KeyError) as e:
+            problems.append(f"Error finding file for {label} in round {i+1}: {str(e)}")
+            continue
+        segments.append({
+            "label": label,
+            "filename": data["filenames"][path_index],
+            "path": data["paths"][path_index],
+            "hash": data["hashes"][path_index],
+            "metadata": data["metadata"][path_index],
+            "start": timing[0],
+            "end": timing[1],
+            "speed": params["speeds"][i],
+            "text": params["texts"][i] if i < len(params["texts"]) else "",
+        })
+    return segments, problems
+
+
+def build_render_jobs(video_params, group_clips, rows, output_path_for, backend=renderer.DEFAULT_BACKEND, threads=None, options=None):
+    """Turn every sequence into a batch_render job
+
+    output_path_for(i) returns where video i is written. Returns (jobs, problems).
+    """
+    render_jobs = []
+    problems = []
+    for i, row in enumerate(rows):
+        segments, round_problems = resolve_round(i, video_params, group_clips, row)
+        problems.extend(round_problems)
+        if not segments:
+            problems.append(f"No valid clips found for round {i+1}")
+            continue
+        render_jobs.append(batch_render.make_job(i, segments, output_path_for(i), backend, threads, options=options))
+    return render_jobs, problems
+
+
+def render_previews(video_params, group_clips, rows, threads=None):
+    """Render a low-resolution proxy preview of every sequence
+
+    Returns one {"index", "path", "error", "seconds"} per sequence; problems
+    resolving the sequences are reported as in build_render_jobs.
+    """
+    previews = []
+    problems = []
+    for i, row in enumerate(rows):
+        segments, round_problems = resolve_round(i, video_params, group_clips, row)
+        problems.extend(round_problems)
+        if not segments:
+            problems.append(f"No valid clips found for round {i+1}")
+            continue
+        started = time.time()
+        try:
+            path, error = proxy.render_preview(segments, threads), None
+        except Exception as e:
+            path, error = None, str(e)
+        previews.append({"index": i, "path": path, "error": error, "seconds": time.time() - started})
+    return previews, problems
+
+
+# === Manifests ===
+def load_manifest(path):
+    """Read a JSON or YAML batch manifest"""
+    with open(path) as f:
+        if path.lower().endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise RuntimeError("PyYAML is required for YAML manifests (pip install pyyaml)")
+            manifest = yaml.safe_load(f)
+        else:
+            manifest = json.load(f)
+    if not manifest.get("groups"):
+        raise ValueError("Manifest must list at least one group")
+    return manifest
+
+
+def _per_video(value, count, default):
+    """Expand a manifest setting (missing, a single value, or a list) to one value per video"""
+    if value is None:
+        return [default] * count
+    if not isinstance(value, list):
+        return [value] * count
+    return (list(value) + [default] * count)[:count]
+
+
+def _check_lists(manifest, count):
+    """Reject per-video timings or speeds lists with fewer entries than videos"""
+    for n, group in enumerate(manifest["groups"]):
+        label = group.get("label", f"Group {n+1}")
+        for key in ("timings", "speeds"):
+            value = group.get(key)
+            if isinstance(value, list) and len(value) < count:
+                raise ValueError(f"Group {label!r}: {key} has {len(value)} entries, expected {count} (one per video)")
+
+
+def plan_manifest(manifest, base_dir="."):
+    """Ingest a manifest's files and resolve its sequences and clip settings
+
+    Each group is {"label", "files", "timings", "speeds", "texts"}. timings may be
+    a list of [start, end] pairs, "random" (the default) or "full"; speeds and
+    texts may be a single value or one per video (a list of timings or speeds must
+    have an entry for every video; texts are padded with ""). Sources are picked with smart
+    selection unless "smart_selection" is false. Returns (video_params,
+    group_clips, rows).
+    """
+    count = int(manifest.get("count", 1))
+    rng = random.Random(manifest.get("seed"))
+    normalize = manifest.get("normalize", False)
+    all_intra = manifest.get("all_intra", False)
+    _check_lists(manifest, count)
+
+    video_params = {}
+    for n, group in enumerate(manifest["groups"]):
+        label = group.get("label", f"Group {n+1}")
+        paths = [os.path.join(base_dir, p) for p in group["files"]]
+        records = ingest_files(paths, normalize, all_intra)
+        video_params[label] = group_params(records, normalize, all_intra)
+
+    rows, generated_sequences = generate_sequences(video_params, count, rng, manifest.get("smart_selection", True))
+
+    group_clips = {}
+    for n, group in enumerate(manifest["groups"]):
+        label = group.get("label", f"Group {n+1}")
+        durations = [d for _, d in generated_sequences.get(label, [])]
+        timings = group.get("timings", "random")
+        if timings == "random":
+            timings = [random_timing(d, rng) for d in durations]
+        elif timings == "full":
+            timings = [(0.0, d) for d in durations]
+        speeds = group.get("speeds", 1.0)
+        if speeds == "random":
+            speeds = [random_speed(rng) for _ in durations]
+        group_clips[label] = {
+            "timings": [tuple(map(float, t)) for t in _per_video(timings, count, None)],
+            "speeds": [float(s) for s in _per_video(speeds, count, 1.0)],
+            "texts": [str(t) for t in _per_video(group.get("texts"), count, "")],
+        }
+    return video_params, group_clips, rows
+
+
+def run_manifest(manifest, output_dir, base_dir=".", workers=None, threads=None, backend=None, on_result=None):
+    """Render a whole manifest and return a machine-readable results document"""
+    started = time.time()
+    backend = backend or manifest.get("backend") or renderer.DEFAULT_BACKEND
+    options = manifest.get("options", {})
+    encoder_profile = encoder_profiles.profile_name(options)
+    # Unless given, workers and threads come from the encoder profile so cores are not oversubscribed
+    workers, planned_threads = encoder_profiles.plan_parallelism(
+        encoder_profile, batch_render.CPU_COUNT, workers or manifest.get("workers")
+    )
+    threads = threads or manifest.get("threads") or planned_threads
+
+    video_params, group_clips, rows = plan_manifest(manifest, base_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    render_jobs, problems = build_render_jobs(
+        video_params, group_clips, rows,
+        lambda i: os.path.abspath(os.path.join(output_dir, f"combined_{i+1:03d}.mp4")),
+        backend, threads, options,
+    )
+    results = batch_render.run_batch(render_jobs, workers=workers, on_result=on_result)
+
+    segments_by_index = {job["index"]: job["segments"] for job in render_jobs}
+    videos = []
+    for result in results:
+        videos.append({
+            "sequence": result["index"] + 1,
+            "output_path": None if result["error"] else result["output_path"],
+            "backend": result["backend"],
+            "fallback": result.get("fallback", False),
+            "encoder_profile": result["encoder_profile"],
+            "reused": result["reused"],
+            "error": result["error"],
+            "seconds": round(result["seconds"], 3),
+            "output_bytes": result["output_bytes"],
+            "resources": result.get("resources"),
+            "profile": result.get("profile"),
+            "segments": [
+                {key: seg[key] for key in ("label", "filename", "start", "end", "speed", "text")}
+                for seg in segments_by_index[result["index"]]
+            ],
+        })
+    return {
+        "started": started,
+        "finished": time.time(),
+        "backend": backend,
+        "encoder_profile": encoder_profile,
+        "workers": workers,
+        "threads": threads,
+        "seed": manifest.get("seed"),
+        "requested": len(rows),
+        "succeeded": sum(1 for v in videos if not v["error"]),
+        "reused": sum(1 for v in videos if v["reused"] and not v["error"]),
+        "failed": sum(1 for v in videos if v["error"]) + (len(rows) - len(render_jobs)),
+        "problems": problems,
+        "stages": profiling.stage_totals(results),
+        "encoders": profiling.encoder_rows(results),
+        "videos": videos,
+    }
@@ -0,0 +1,253 @@
+"""Native ffmpeg render backend: a whole sequence in one filter_complex invocation"""
+import os
+import signal
+import subprocess
+import threading
+
+from moviepy.config import FFMPEG_BINARY
+
+import encoder_profiles
+import overlays
+import profiling
+from moviepy_render import OUTPUT_SIZE
+
+AUDIO_RATE = 44100
+DEFAULT_FPS = 30
+# Widest factor a single atempo stage handles cleanly; larger changes are chained
+ATEMPO_RANGE = (0.5, 2.0)
+
+# Running ffmpeg processes grouped by cancel tag, so a whole batch can be killed at once
+_processes = {}
+_canceled_tags = set()
+_process_lock = threading.Lock()
+_local = threading.local()
+
+
+class RenderCanceled(Exception):
+    """Raised when a render is stopped on purpose rather than failing"""
+
+
+def segment_window(segment):
+    """Return (start, duration) of the source window a segment plays"""
+    start = segment["start"]
+    end = segment["end"]
+    source_duration = segment.get("metadata", {}).get("duration")
+    if source_duration:
+        end = min(end, source_duration - 0.01)
+    if end <= start:
+        raise ValueError(f"Empty clip window {start}s to {end}s for {os.path.basename(segment['path'])}")
+    if segment["speed"] <= 0:
+        raise ValueError(f"Speed must be positive, got {segment['speed']}")
+    return start, end - start
+
+
+def played_duration(segment):
+    """How long a segment lasts in the output once its speed is applied"""
+    return segment_window(segment)[1] / segment["speed"]
+
+
+def atempo_chain(speed):
+    """atempo stages whose product is speed, each within ATEMPO_RANGE"""
+    low, high = ATEMPO_RANGE
+    stages = []
+    while speed > high:
+        stages.append(high)
+        speed /= high
+    while speed < low:
+        stages.append(low)
+        speed /= low
+    stages.append(speed)
+    return ",".join(f"atempo={s:.6g}" for s in stages if s != 1.0)
+
+
+def speed_video_filters(speed, fps):
+    """Retime a segment's frames to `speed`, dropping or duplicating them at the output fps
+
+    Runs right after decoding, so frames a fast clip skips are never scaled,
+    overlaid or encoded.
+    """
+    if speed == 1.0:
+        return f"setpts=PTS-STARTPTS,fps={fps}"
+    return f"setpts=(PTS-STARTPTS)/{speed:.6g},fps={fps}"
+
+
+def speed_audio_filters(speed):
+    """Tempo-change a segment's audio without shifting its pitch"""
+    chain = atempo_chain(speed)
+    return chain + "," if chain else ""
+
+
+def output_fps(segments):
+    """Frame rate of the combined video (the highest source rate, like concatenate_videoclips)"""
+    rates = [seg.get("metadata", {}).get("fps") or 0 for seg in segments]
+    return max(rates) if any(rates) else DEFAULT_FPS
+
+
+def build_command(segments, output_path, overlay_paths, threads=None, size=OUTPUT_SIZE, fps=None, options=None):
+    """Build the ffmpeg argument list that renders all segments into output_path
+
+    size and fps are only changed for previews; overlays are rasterized for
+    OUTPUT_SIZE and scaled down with the picture. The encoder profile comes from
+    options. threads caps decoders, filters and the encoder alike.
+    """
+    width, height = size
+    fps = fps or output_fps(segments)
+    overlay_scale = width / OUTPUT_SIZE[0]
+    with_audio = any(seg.get("metadata", {}).get("has_audio") for seg in segments)
+
+    inputs = []
+    n_inputs = 0
+    filters = []
+    concat_inputs = ""
+    for i, seg in enumerate(segments):
+        start, window = segment_window(seg)
+        duration = window / seg["speed"]
+        src = n_inputs
+        if threads:
+            # Decoders otherwise start a thread per core for every input
+            inputs += ["-threads", str(threads)]
+        inputs += ["-ss", f"{start:.3f}", "-t", f"{window:.3f}", "-i", seg["path"]]
+        n_inputs += 1
+
+        chain = f"[{src}:v]{speed_video_filters(seg['speed'], fps)},scale={width}:{height},setsar=1"
+        if overlay_paths.get(i):
+            ov = n_inputs
+            # A single still frame: overlay repeats its last frame for the whole segment
+            inputs += ["-i", overlay_paths[i]]
+            n_inputs += 1
+            filters.append(f"{chain}[base{i}]")
+            overlay_input = f"[{ov}:v]"
+            if overlay_scale != 1:
+                filters.append(f"{overlay_input}scale=iw*{overlay_scale:.6g}:-1[ov{i}]")
+                overlay_input = f"[ov{i}]"
+            filters.append(f"[base{i}]{overlay_input}overlay=x=(W-w)/2:y={round(overlays.TEXT_STYLE['top'] * overlay_scale)}[v{i}]")
+        else:
+            filters.append(f"{chain}[v{i}]")
+        concat_inputs += f"[v{i}]"
+
+        if with_audio:
+            if seg.get("metadata", {}).get("has_audio"):
+                filters.append(
+                    f"[{src}:a]{speed_audio_filters(seg['speed'])}aresample={AUDIO_RATE},aformat=sample_fmts=fltp:channel_layouts=stereo,"
+                    f"apad,atrim=0:{duration:.3f},asetpts=PTS-STARTPTS[a{i}]"
+                )
+            else:
+                filters.append(f"anullsrc=r={AUDIO_RATE}:cl=stereo,atrim=0:{duration:.3f}[a{i}]")
+            concat_inputs += f"[a{i}]"
+
+    filters.append(f"{concat_inputs}concat=n={len(segments)}:v=1:a={1 if with_audio else 0}[vcat]" + ("[aout]" if with_audio else ""))
+    # Resample once after concat; concat itself does not carry a frame rate through
+    filters.append(f"[vcat]fps={fps}[vout]")
+
+    cmd = [FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error"]
+    if threads:
+        cmd += ["-filter_complex_threads", str(threads)]
+    cmd += inputs
+    cmd += ["-filter_complex", ";".join(filters), "-map", "[vout]"]
+    if with_audio:
+        cmd += ["-map", "[aout]", "-c:a", "aac", "-ar", str(AUDIO_RATE)] + encoder_profiles.audio_args(options)
+    cmd += ["-c:v", "libx264"] + encoder_profiles.video_args(options, fps)
+    cmd += ["-pix_fmt", "yuv420p", "-movflags", "+faststart"]
+    if threads:
+        cmd += ["-threads", str(threads)]
+    cmd.append(output_path)
+    return cmd
+
+
+def render_segments(segments, output_path, threads=None, options=None):
+    """Render a sequence of segments to a single file with one ffmpeg process"""
+    overlay_paths = {
+        i: overlays.get_overlay(seg["text"].strip(), OUTPUT_SIZE[0])[0]
+        for i, seg in enumerate(segments) if seg["text"].strip()
+    }
+    with profiling.stage(profiling.FILTER_GRAPH):
+        run_ffmpeg(build_command(segments, output_path, overlay_paths, threads, options=options))
+    return output_path
+
+
+def set_cancel_tag(tag):
+    """Group ffmpeg processes started by the current thread under tag"""
+    _local.tag = tag
+
+
+def cancel_processes(tag):
+    """Kill every running ffmpeg process started under tag and refuse new ones
+
+    Processes are only signalled here. Popen.kill() polls first and could reap a
+    child that just exited, leaving _wait nothing to collect, so reaping is left to _wait.
+    """
+    with _process_lock:
+        _canceled_tags.add(tag)
+        for proc in _processes.get(tag, ()):
+            _kill(proc)
+
+
+def _kill(proc):
+    if not hasattr(os, "wait4"):
+        proc.kill()
+        return
+    # Unreaped while it is in _processes (a zombie at worst), so the pid cannot have been reused
+    try:
+        os.kill(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def check_canceled():
+    """Raise RenderCanceled if the current thread's render was canceled"""
+    tag = getattr(_local, "tag", None)
+    with _process_lock:
+        if tag is not None and tag in _canceled_tags:
+            raise RenderCanceled("Render canceled")
+
+
+def release_tag(tag):
+    """Forget a tag once nothing can start under it anymore"""
+    with _process_lock:
+        _canceled_tags.discard(tag)
+        _processes.pop(tag, None)
+
+
+def run_ffmpeg(cmd):
+    """Run an ffmpeg command, raising RuntimeError with its stderr on failure"""
+    tag = getattr(_local, "tag", None)
+    with _process_lock:
+        if tag is not None and tag in _canceled_tags:
+            raise RenderCanceled("Render canceled")
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        _processes.setdefault(tag, set()).add(proc)
+    try:
+        stderr = _wait(proc, tag)
+    except ChildProcessError:
+        # Reaped elsewhere, so its exit status is lost; after a cancel that is expected
+        check_canceled()
+        raise RuntimeError("ffmpeg exit status was lost") from None
+    finally:
+        with _process_lock:
+            _processes.get(tag, set()).discard(proc)
+
+    check_canceled()
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with code {proc.returncode}: {stderr.decode(errors='replace').strip()[-2000:]}")
+
+
+def _wait(proc, tag=None):
+    """Wait for an ffmpeg process and charge its CPU time and peak memory to the current profile stage
+
+    The process is reaped under the lock that cancel_processes signals under,
+    and leaves _processes at the same time, so it is never killed after reaping.
+    """
+    if not hasattr(os, "wait4"):
+        return proc.communicate()[1]
+    stderr = proc.stderr.read()
+    proc.stderr.close()
+    if hasattr(os, "waitid"):
+        # Block until it exits but leave it unreaped
+        os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+    with _process_lock:
+        _, status, usage = os.wait4(proc.pid, 0)
+        _processes.get(tag, set()).discard(proc)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux
+    profiling.add_process_usage(usage.ru_utime + usage.ru_stime, usage.ru_maxrss * 1024)
+    return stderr
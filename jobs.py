@@ -0,0 +1,290 @@
+"""Background render jobs shared by every session on the server.
+
+A job is one batch of combined videos. Jobs run on a small dispatcher pool
+outside the Streamlit script thread, so browser sessions only poll their status;
+the state of every job is also written to disk so it can be shown again after a
+page reload (or, as "interrupted", after a server restart).
+
+Each job has a workspace directory holding its videos, its plan and a journal
+of finished videos that is synced to disk as each one completes. A job that was
+interrupted, failed or canceled can be resumed from the journal: only videos
+that have not finished are rendered again.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import batch_render
+import packager
+import profiling
+
+JOBS_DIR = os.environ.get(
+    "VIDEO_EDITOR_JOBS_DIR",
+    os.path.join(tempfile.gettempdir(), "auto_video_editor", "jobs"),
+)
+# How many batches may render at the same time; further submissions wait in the queue
+MAX_ACTIVE_JOBS = int(os.environ.get("VIDEO_EDITOR_MAX_ACTIVE_JOBS", "2"))
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELED = "canceled"
+INTERRUPTED = "interrupted"
+FINISHED_STATES = (COMPLETED, FAILED, CANCELED, INTERRUPTED)
+
+_jobs = {}
+_cancel_requested = set()
+_lock = threading.Lock()
+_dispatcher = ThreadPoolExecutor(max_workers=MAX_ACTIVE_JOBS, thread_name_prefix="render-job")
+
+
+def new_job_id():
+    """Reserve an ID, so output paths inside the job's workspace can be planned before submitting"""
+    return uuid.uuid4().hex[:12]
+
+
+def workspace_dir(job_id):
+    """Directory holding a job's videos, plan and journal"""
+    return os.path.join(JOBS_DIR, os.path.basename(job_id))
+
+
+def output_path(job_id, index):
+    """Where a job delivers combined video `index`"""
+    return os.path.join(workspace_dir(job_id), f"combined_{index + 1:03d}.mp4")
+
+
+def submit_job(render_jobs, workers=batch_render.DEFAULT_WORKERS, delivery=packager.DELIVERY_ZIP, job_id=None):
+    """Queue a batch of batch_render jobs and return its job ID
+
+    With ZIP delivery each finished video is added to the job's archive right away.
+    """
+    job_id = job_id or new_job_id()
+    for render_job in render_jobs:
+        render_job["tag"] = job_id
+    state = {
+        "id": job_id,
+        "status": QUEUED,
+        "total": len(render_jobs),
+        "completed": 0,
+        "results": [],
+        "workers": workers,
+        "planned_output_seconds": [(job["index"], batch_render.planned_output_seconds(job)) for job in render_jobs],
+        "delivery": delivery,
+        "archive": packager.archive_path(job_id) if delivery == packager.DELIVERY_ZIP else None,
+        "created": time.time(),
+        "started": None,
+        "finished": None,
+        "error": None,
+        "resumed": 0,
+    }
+    os.makedirs(workspace_dir(job_id), exist_ok=True)
+    _write_atomic(os.path.join(workspace_dir(job_id), "plan.json"), json.dumps(render_jobs))
+    with _lock:
+        _jobs[job_id] = state
+    _save(state)
+    _dispatcher.submit(_run_job, job_id, render_jobs, workers)
+    return job_id
+
+
+def resume_job(job_id):
+    """Queue the unfinished videos of an interrupted, failed or canceled job again
+
+    Videos recorded in the journal whose files still exist are kept as they are.
+    Returns False when the job is still active or its plan is gone.
+    """
+    with _lock:
+        if job_id in _jobs and _jobs[job_id]["status"] not in FINISHED_STATES:
+            return False
+    state = get_job(job_id)
+    try:
+        with open(os.path.join(workspace_dir(job_id), "plan.json")) as f:
+            render_jobs = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if state is None:
+        return False
+
+    finished = {
+        result["index"]: result for result in _read_journal(job_id)
+        if not result["error"] and os.path.exists(result["output_path"])
+    }
+    remaining = [job for job in render_jobs if job["index"] not in finished]
+    if state["archive"]:
+        # An append cut short by a crash leaves the archive unreadable; rebuild it from the journal
+        packager.repair_archive(state["archive"], list(finished.values()))
+    state.update(
+        status=QUEUED,
+        results=sorted(finished.values(), key=lambda r: r["index"]),
+        completed=len(finished),
+        started=None,
+        finished=None,
+        error=None,
+        resumed=state.get("resumed", 0) + 1,
+    )
+    with _lock:
+        _jobs[job_id] = state
+    _save(state)
+    _dispatcher.submit(_run_job, job_id, remaining, state["workers"])
+    return True
+
+
+def can_resume(job):
+    """Whether a finished job has videos left that resume_job() would render"""
+    if job["status"] not in FINISHED_STATES:
+        return False
+    return job["completed"] < job["total"] or any(
+        r["error"] or not os.path.exists(r["output_path"]) for r in job["results"]
+    )
+
+
+def core_budget():
+    """Cores a new batch may plan for: the machine shared with the batches already queued or running"""
+    with _lock:
+        active = sum(1 for state in _jobs.values() if state["status"] not in FINISHED_STATES)
+    return max(1, batch_render.CPU_COUNT // min(MAX_ACTIVE_JOBS, active + 1))
+
+
+def active_references():
+    """Store keys that running or queued jobs still need: job IDs, sources and outputs"""
+    with _lock:
+        active = [job_id for job_id, state in _jobs.items() if state["status"] not in FINISHED_STATES]
+    references = set(active)
+    for job_id in active:
+        try:
+            with open(os.path.join(workspace_dir(job_id), "plan.json")) as f:
+                render_jobs = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for job in render_jobs:
+            references.add(job["output_key"])
+            references.update(seg["hash"].split(".")[0] for seg in job["segments"])
+    return references
+
+
+def get_job(job_id):
+    """Return a snapshot of a job's state, or None if it is unknown"""
+    with _lock:
+        state = _jobs.get(job_id)
+        if state is not None:
+            return json.loads(json.dumps(state))
+    # Not in this process: the server restarted since the job was submitted
+    state = _load(job_id)
+    if state is not None and state["status"] not in FINISHED_STATES:
+        state["status"] = INTERRUPTED
+    return state
+
+
+def cancel_job(job_id):
+    """Ask a job to stop; queued jobs never start and running encoders are killed"""
+    with _lock:
+        if job_id in _jobs and _jobs[job_id]["status"] not in FINISHED_STATES:
+            _cancel_requested.add(job_id)
+
+
+def _run_job(job_id, render_jobs, workers):
+    """Dispatcher entry point: render a whole batch and record progress"""
+    if _is_cancel_requested(job_id):
+        _finish(job_id, CANCELED)
+        return
+    _update(job_id, status=RUNNING, started=time.time())
+
+    def on_result(result, completed, total):
+        with _lock:
+            state = _jobs[job_id]
+            archive = state["archive"]
+        if archive and not result["error"]:
+            wall, cpu = time.perf_counter(), time.thread_time()
+            try:
+                packager.add_to_archive(archive, result["output_path"], packager.output_name(result))
+            except Exception as e:
+                result["error"] = f"Rendered, but could not be added to the archive: {str(e)}"
+            profiling.add_stage(result["profile"], profiling.PACKAGE, time.perf_counter() - wall, time.thread_time() - cpu)
+        _journal(job_id, result)
+        with _lock:
+            state["results"].append(result)
+            # A resumed job starts with the videos it already had
+            state["completed"] = len(state["results"])
+        _save(state)
+
+    try:
+        batch_render.run_batch(
+            render_jobs,
+            workers=workers,
+            on_result=on_result,
+            should_stop=lambda: _is_cancel_requested(job_id),
+        )
+    except Exception as e:
+        _update(job_id, error=str(e))
+        _finish(job_id, FAILED)
+        return
+    _finish(job_id, CANCELED if _is_cancel_requested(job_id) else COMPLETED)
+
+
+def _is_cancel_requested(job_id):
+    with _lock:
+        return job_id in _cancel_requested
+
+
+def _update(job_id, **changes):
+    with _lock:
+        state = _jobs[job_id]
+        state.update(changes)
+    _save(state)
+
+
+def _finish(job_id, status):
+    with _lock:
+        _cancel_requested.discard(job_id)
+    _update(job_id, status=status, finished=time.time())
+
+
+def _journal(job_id, result):
+    """Record a finished video durably before the job's state says so"""
+    with open(os.path.join(workspace_dir(job_id), "journal.jsonl"), "a") as f:
+        f.write(json.dumps(result) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _read_journal(job_id):
+    """Finished videos recorded for a job; a line cut off by a crash is ignored"""
+    results = []
+    try:
+        with open(os.path.join(workspace_dir(job_id), "journal.jsonl")) as f:
+            for line in f:
+                try:
+                    results.append(json.loads(line))
+                except ValueError:
+                    continue
+    except OSError:
+        pass
+    return results
+
+
+def _save(state):
+    """Persist a job's state atomically"""
+    with _lock:
+        payload = json.dumps(state)
+    _write_atomic(os.path.join(JOBS_DIR, f"{state['id']}.json"), payload)
+
+
+def _write_atomic(path, payload):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".part"
+    with open(tmp_path, "w") as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+def _load(job_id):
+    path = os.path.join(JOBS_DIR, f"{os.path.basename(job_id)}.json")
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,159 @@
+"""Optional upload-time normalization to a uniform mezzanine format.
+
+Each upload can be transcoded once, in the background, to 1080x1920 at a
+constant frame rate with a short GOP (or all-intra) and a fixed AAC stereo
+track. Renders then cut from the mezzanine instead of the original, so trims
+are cheap and seek-accurate and the clips qualify for the stream-copy path.
+"""
+import os
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from moviepy.config import FFMPEG_BINARY
+
+import ffmpeg_render
+import segment_cache
+import upload_store
+from moviepy_render import OUTPUT_SIZE
+
+MEZZANINE_FPS = segment_cache.SEGMENT_FPS
+# Keyframe every half second; all-intra makes every frame a keyframe
+GOP_SIZE = MEZZANINE_FPS // 2
+MAX_WORKERS = int(os.environ.get("VIDEO_EDITOR_MEZZANINE_WORKERS", "2"))
+# A transcode still running after this long (e.g. stuck on a damaged upload) is killed and failed
+TIMEOUT_SECONDS = float(os.environ.get("VIDEO_EDITOR_MEZZANINE_TIMEOUT", "1800"))
+
+PENDING = "pending"
+RUNNING = "running"
+READY = "ready"
+FAILED = "failed"
+
+_status = {}
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="mezzanine")
+
+
+def mezzanine_id(digest, all_intra=False):
+    """Store key of a mezzanine (its metadata and keyframes are cached under it)"""
+    return f"{digest}.{'intra' if all_intra else 'mezz'}"
+
+
+def mezzanine_path(digest, all_intra=False):
+    """Location of the mezzanine rendition of an upload"""
+    return upload_store.store_path(mezzanine_id(digest, all_intra), ".mp4")
+
+
+def request_mezzanine(record, all_intra=False):
+    """Queue normalization of an upload unless it is already done, in progress or failed
+
+    A failure is final (and keeps its error) until retry_mezzanine is called.
+    """
+    mezz_id = mezzanine_id(record["hash"], all_intra)
+    with _lock:
+        if _status.get(mezz_id, {}).get("state") in (PENDING, RUNNING, FAILED):
+            return
+        if os.path.exists(mezzanine_path(record["hash"], all_intra)):
+            _status[mezz_id] = {"state": READY, "progress": 1.0, "error": None}
+            return
+        _status[mezz_id] = {"state": PENDING, "progress": 0.0, "error": None}
+    _executor.submit(_normalize, record, all_intra)
+
+
+def retry_mezzanine(record, all_intra=False):
+    """Forget a failed normalization and queue it again"""
+    mezz_id = mezzanine_id(record["hash"], all_intra)
+    with _lock:
+        if _status.get(mezz_id, {}).get("state") == FAILED:
+            del _status[mezz_id]
+    request_mezzanine(record, all_intra)
+
+
+def mezzanine_status(digest, all_intra=False):
+    """Return {"state", "progress", "error"} for an upload's mezzanine"""
+    mezz_id = mezzanine_id(digest, all_intra)
+    exists = os.path.exists(mezzanine_path(digest, all_intra))
+    with _lock:
+        if mezz_id in _status and (exists or _status[mezz_id]["state"] != READY):
+            return dict(_status[mezz_id])
+    if exists:
+        return {"state": READY, "progress": 1.0, "error": None}
+    return {"state": None, "progress": 0.0, "error": None}
+
+
+def resolve(record, all_intra=False):
+    """Return (hash, path, metadata) to render from: the mezzanine when ready, else the upload"""
+    if mezzanine_status(record["hash"], all_intra)["state"] != READY:
+        return record["hash"], record["path"], record["metadata"]
+    mezz_id = mezzanine_id(record["hash"], all_intra)
+    path = mezzanine_path(record["hash"], all_intra)
+    return mezz_id, path, upload_store.get_metadata(mezz_id, path)
+
+
+def build_command(record, output_path, all_intra=False):
+    """ffmpeg arguments that normalize one upload"""
+    width, height = OUTPUT_SIZE
+    duration = record["metadata"]["duration"]
+    cmd = [FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error", "-nostats", "-progress", "pipe:1"]
+    cmd += ["-i", record["path"]]
+    if record["metadata"].get("has_audio"):
+        audio_map = "0:a:0"
+    else:
+        # Always carry an audio track so every mezzanine has the same layout
+        cmd += ["-f", "lavfi", "-t", f"{duration:.3f}", "-i", f"anullsrc=r={ffmpeg_render.AUDIO_RATE}:cl=stereo"]
+        audio_map = "1:a:0"
+    cmd += ["-map", "0:v:0", "-map", audio_map]
+    cmd += ["-vf", f"scale={width}:{height},setsar=1,fps={MEZZANINE_FPS}"]
+    cmd += ["-c:v", "libx264", "-preset", "veryfast", "-crf", "18", "-pix_fmt", "yuv420p"]
+    gop = 1 if all_intra else GOP_SIZE
+    cmd += ["-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0"]
+    cmd += ["-c:a", "aac", "-b:a", "192k", "-ar", str(ffmpeg_render.AUDIO_RATE), "-ac", "2"]
+    cmd += ["-t", f"{duration:.3f}", "-video_track_timescale", str(segment_cache.VIDEO_TIMESCALE)]
+    cmd += ["-movflags", "+faststart", "-f", "mp4", output_path]
+    return cmd
+
+
+def _normalize(record, all_intra):
+    """Worker: transcode one upload, reporting progress from ffmpeg's -progress output"""
+    mezz_id = mezzanine_id(record["hash"], all_intra)
+    path = mezzanine_path(record["hash"], all_intra)
+    tmp_path = path + ".part"
+    duration = record["metadata"]["duration"] or 1.0
+    _set_status(mezz_id, state=RUNNING)
+    try:
+        # stderr goes to a file: a damaged upload can log more errors than a pipe holds,
+        # and ffmpeg would block on it while progress is read from stdout
+        with tempfile.TemporaryFile("w+") as errors:
+            proc = subprocess.Popen(
+                build_command(record, tmp_path, all_intra),
+                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=errors, text=True,
+            )
+            timed_out = threading.Event()
+            timer = threading.Timer(TIMEOUT_SECONDS, lambda: (timed_out.set(), proc.kill()))
+            timer.start()
+            try:
+                for line in proc.stdout:
+                    key, _, value = line.strip().partition("=")
+                    if key == "out_time_us" and value.isdigit():
+                        _set_status(mezz_id, progress=min(int(value) / 1e6 / duration, 1.0))
+                proc.wait()
+            finally:
+                timer.cancel()
+            errors.seek(0)
+            stderr = errors.read().strip()[-2000:]
+        if timed_out.is_set():
+            raise RuntimeError(f"ffmpeg timed out after {TIMEOUT_SECONDS:.0f}s: {stderr}")
+        if proc.returncode != 0:
+            raise RuntimeError(f"ffmpeg exited with code {proc.returncode}: {stderr}")
+        os.replace(tmp_path, path)
+        _set_status(mezz_id, state=READY, progress=1.0)
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        _set_status(mezz_id, state=FAILED, error=str(e))
+
+
+def _set_status(mezz_id, **changes):
+    with _lock:
+        _status[mezz_id].update(changes)
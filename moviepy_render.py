@@ -0,0 +1,151 @@
+"""MoviePy render backend: every output frame is produced in Python"""
+import os
+import subprocess
+import threading
+
+import numpy as np
+from moviepy import VideoFileClip, video
+from moviepy.audio.AudioClip import AudioArrayClip
+from moviepy.config import FFMPEG_BINARY
+
+import encoder_profiles
+import overlays
+import profiling
+
+OUTPUT_SIZE = (1080, 1920)
+# Video decoders (ffmpeg subprocesses with their frame buffers) one render may keep running
+MAX_OPEN_READERS = int(os.environ.get("VIDEO_EDITOR_MAX_READERS", "4"))
+
+
+class ReaderPool:
+    """Source clips for one render: one reader per file, a bounded number of live decoders
+
+    Segments cut from the same file share its VideoFileClip. When a decoder is
+    needed and MAX_OPEN_READERS are already running, the least recently used one
+    is stopped; MoviePy restarts it at the right position if that source is read
+    again. Everything is closed when the pool is.
+    """
+
+    def __init__(self, max_open=MAX_OPEN_READERS):
+        self.max_open = max(1, max_open)
+        self._clips = {}
+        self._live = []  # paths with a running decoder, least recently used first
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get(self, path):
+        """Return the shared source clip for a file, opening it on first use"""
+        with self._lock:
+            clip = self._clips.get(path)
+            if clip is None:
+                self._make_room()
+                clip = VideoFileClip(path)
+                read_frame = clip.frame_function
+                clip.frame_function = lambda t: self._read(path, read_frame, t)
+                self._clips[path] = clip
+                self._live.append(path)
+            return clip
+
+    def _read(self, path, read_frame, t):
+        with self._lock:
+            if path in self._live:
+                self._live.remove(path)
+            else:
+                self._make_room()
+            self._live.append(path)
+            with profiling.stage(profiling.DECODE):
+                return read_frame(t)
+
+    def _make_room(self):
+        while len(self._live) >= self.max_open:
+            reader = self._clips[self._live.pop(0)].reader
+            if reader is not None:
+                # Keep the last frame so a restarted reader can pick up where it left off
+                reader.close(delete_lastread=False)
+
+    def open_count(self):
+        """Number of decoders currently running"""
+        with self._lock:
+            return len(self._live)
+
+    def close(self):
+        """Stop every decoder and release every source clip"""
+        with self._lock:
+            for clip in self._clips.values():
+                clip.close()
+            self._clips.clear()
+            self._live.clear()
+
+
+def create_processed_clip(video_path, timing, speed, text, pool=None):
+    """Create a processed video clip with timing, speed, and text overlay
+
+    With a pool the source comes from (and is closed by) the pool; otherwise
+    the caller must close the returned clip.
+    """
+    clip = pool.get(video_path) if pool is not None else VideoFileClip(video_path)
+    end_time = min(timing[1], clip.duration - 0.01)
+    base_clip = clip.subclipped(timing[0], end_time)
+    if speed != 1.0:
+        has_audio = base_clip.audio is not None
+        # Remap time so only the frames that are shown get decoded and resized
+        base_clip = base_clip.with_effects([video.fx.MultiplySpeed(speed)])
+        if has_audio:
+            # A plain time remap would shift the pitch; match the ffmpeg backends instead
+            base_clip = base_clip.with_audio(tempo_audio(video_path, timing[0], end_time, speed, base_clip.duration))
+    base_clip = base_clip.with_effects([video.fx.Resize(list(OUTPUT_SIZE))])
+    base_clip.frame_function = profiling.timed(profiling.RESIZE, base_clip.frame_function)
+
+    if text.strip():
+        # Blend the cached caption raster into the frame's text box only, instead of compositing whole frames
+        caption = text.strip()
+        blend = profiling.timed(profiling.COMPOSITE, lambda frame: overlays.blend_overlay(frame, caption))
+        return base_clip.image_transform(blend)
+    return base_clip
+
+
+def tempo_audio(path, start, end, speed, duration):
+    """A source's audio from start to end, sped up with ffmpeg's atempo (pitch kept) and fit to duration"""
+    import ffmpeg_render  # imported here: ffmpeg_render imports this module
+
+    cmd = [
+        FFMPEG_BINARY, "-hide_banner", "-loglevel", "error",
+        "-ss", f"{start:.3f}", "-t", f"{end - start:.3f}", "-i", path,
+        "-vn", "-af", ffmpeg_render.atempo_chain(speed),
+        "-ac", "2", "-ar", str(ffmpeg_render.AUDIO_RATE), "-f", "f32le", "-",
+    ]
+    with profiling.stage(profiling.DECODE):
+        proc = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with code {proc.returncode}: {proc.stderr.decode(errors='replace').strip()[-2000:]}")
+    samples = np.frombuffer(proc.stdout, dtype=np.float32).reshape(-1, 2)
+    # atempo's output is a few samples off the video's length; pad or trim so both end together
+    count = int(round(duration * ffmpeg_render.AUDIO_RATE))
+    samples = np.pad(samples[:count], ((0, max(0, count - len(samples))), (0, 0)))
+    return AudioArrayClip(samples, fps=ffmpeg_render.AUDIO_RATE)
+
+
+def render_segments(segments, output_path, threads=None, options=None):
+    """Render a sequence of segments to a single file with MoviePy"""
+    with ReaderPool() as pool:
+        clips = []
+        for i, seg in enumerate(segments):
+            clip = create_processed_clip(seg["path"], (seg["start"], seg["end"]), seg["speed"], seg["text"], pool)
+            clip.frame_function = profiling.in_segment(clip.frame_function, i)
+            clips.append(clip)
+        final_combined = video.compositing.CompositeVideoClip.concatenate_videoclips(clips)
+        try:
+            # Frame production above is timed in its own stages; what is left here is encoding and audio
+            with profiling.stage(profiling.ENCODE):
+                final_combined.write_videofile(
+                    output_path, codec="libx264", audio_codec="aac", threads=threads, logger=None,
+                    **encoder_profiles.moviepy_args(options, final_combined.fps),
+                )
+        finally:
+            final_combined.close()
+    return output_path
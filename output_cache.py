@@ -0,0 +1,110 @@
+"""Finished combined videos, addressed by the full recipe that produced them.
+
+A combined video's key covers every source hash, timing, speed and caption in
+order plus the backend and its render options. Rendering the same recipe again
+(e.g. after editing one line of a 50-video batch) reuses the stored file instead
+of encoding it again.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import encoder_profiles
+import overlays
+import segment_cache
+from moviepy_render import OUTPUT_SIZE
+
+OUTPUT_DIR = os.environ.get(
+    "VIDEO_EDITOR_OUTPUT_DIR",
+    os.path.join(tempfile.gettempdir(), "auto_video_editor", "outputs"),
+)
+# Bump when a backend's encoding changes so older outputs are not reused
+FORMAT_VERSION = 2
+# Options that change how a batch runs but not the pixels or samples it produces
+RUN_OPTIONS = ("reuse_outputs",)
+
+_lock = threading.Lock()
+_key_locks = {}
+
+
+def output_key(segments, backend, options=None):
+    """Fingerprint of everything that affects a combined video's pixels and samples"""
+    payload = {
+        "segments": [
+            {
+                "source": seg["hash"],
+                "start": seg["start"],
+                "end": seg["end"],
+                "speed": seg["speed"],
+                "text": seg["text"].strip(),
+            }
+            for seg in segments
+        ],
+        "backend": backend,
+        "options": {k: v for k, v in (options or {}).items() if k not in RUN_OPTIONS},
+        # The profile's settings, not just its name, so editing a profile re-renders
+        "encoder": encoder_profiles.encoder_settings(options),
+        "size": list(OUTPUT_SIZE),
+        "style": overlays.TEXT_STYLE,
+        "segment_format": segment_cache.FORMAT_VERSION,
+        "version": FORMAT_VERSION,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def output_path(key):
+    """Location of a stored combined video"""
+    return os.path.join(OUTPUT_DIR, key + ".mp4")
+
+
+def key_lock(key):
+    """Lock held while a key is rendered, so identical videos are encoded once"""
+    with _lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+def lookup(key):
+    """Return the backend that rendered a stored video, or None if it is not stored"""
+    try:
+        with open(os.path.join(OUTPUT_DIR, key + ".json")) as f:
+            backend = json.load(f)["backend"]
+    except (OSError, ValueError, KeyError):
+        return None
+    if not os.path.exists(output_path(key)):
+        return None
+    os.utime(output_path(key))  # mark as recently used
+    return backend
+
+
+def render_into(key, render):
+    """Run render(path) into a private file, then store it under key; returns render's result"""
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=OUTPUT_DIR, suffix=".part.mp4")
+    os.close(fd)
+    try:
+        backend = render(tmp_path)
+        os.chmod(tmp_path, 0o644)  # mkstemp files are private; outputs are meant to be shared
+        os.replace(tmp_path, output_path(key))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    with open(os.path.join(OUTPUT_DIR, key + ".json"), "w") as f:
+        json.dump({"backend": backend}, f)
+    return backend
+
+
+def publish(key, destination):
+    """Make a stored video available at destination (hard link, or a copy across filesystems)"""
+    source = output_path(key)
+    if os.path.abspath(destination) == os.path.abspath(source):
+        return destination
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+    return destination
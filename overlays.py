@@ -0,0 +1,134 @@
+"""Rasterized caption overlays, rendered once per distinct caption and reused.
+
+A caption is rasterized to an RGBA image a single time (kept in memory and as a
+PNG on disk). The MoviePy backend blends it onto frames only inside its bounding
+box; the ffmpeg backends feed the PNG to the encoder as a static overlay input.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+from moviepy import TextClip
+
+import profiling
+
+OVERLAY_DIR = os.environ.get(
+    "VIDEO_EDITOR_OVERLAY_DIR",
+    os.path.join(tempfile.gettempdir(), "auto_video_editor", "overlays"),
+)
+
+# Overlay look shared by every backend so they produce the same picture
+TEXT_STYLE = {
+    # Read from the environment so spawned render workers use the same font
+    "font": os.environ.get("VIDEO_EDITOR_CAPTION_FONT", "Mark Simonson - Proxima Nova Semibold-webfont"),
+    "font_size": 60,
+    "color": "white",
+    "stroke_color": "black",
+    "stroke_width": 5,
+    "margin": (5, 5),
+    "width_ratio": 0.8,
+    "top": 225,
+}
+
+_write_lock = threading.Lock()
+
+
+def make_text_clip(text, frame_width, duration=None):
+    """Build the caption TextClip used for overlays"""
+    return TextClip(
+        font=TEXT_STYLE["font"],
+        text=text.strip(),
+        font_size=TEXT_STYLE["font_size"],
+        color=TEXT_STYLE["color"],
+        stroke_color=TEXT_STYLE["stroke_color"],
+        stroke_width=TEXT_STYLE["stroke_width"],
+        duration=duration,
+        margin=TEXT_STYLE["margin"],
+        method='caption',
+        size=(round(frame_width * TEXT_STYLE["width_ratio"]), None),
+        text_align='center'
+    )
+
+
+def overlay_key(text, frame_width):
+    """Identify a caption raster by its text, style and layout width"""
+    payload = {"text": text.strip(), "width": frame_width, "style": TEXT_STYLE}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def rasterize_text(text, frame_width):
+    """Render a caption to an RGBA array (the expensive step this module caches)"""
+    txt = make_text_clip(text, frame_width)
+    try:
+        rgb = txt.get_frame(0)
+        alpha = txt.mask.get_frame(0) if txt.mask is not None else np.ones(rgb.shape[:2])
+    finally:
+        txt.close()
+    return np.dstack([rgb, (alpha * 255).round()]).astype("uint8")
+
+
+@lru_cache(maxsize=256)
+def _overlay_rgba(text, frame_width):
+    """A caption's pixels, read from the overlay store or rasterized"""
+    path = os.path.join(OVERLAY_DIR, overlay_key(text, frame_width) + ".png")
+    if os.path.exists(path):
+        rgba = np.asarray(Image.open(path).convert("RGBA"))
+    else:
+        with profiling.stage(profiling.RASTERIZE):
+            rgba = rasterize_text(text, frame_width)
+    rgba.setflags(write=False)
+    return rgba
+
+
+def get_overlay(text, frame_width):
+    """Return (png_path, rgba) for a caption, rasterizing it at most once"""
+    path = os.path.join(OVERLAY_DIR, overlay_key(text, frame_width) + ".png")
+    rgba = _overlay_rgba(text, frame_width)
+    try:
+        os.utime(path)  # mark as recently used
+    except FileNotFoundError:
+        # Not written yet, or removed by retention since it was cached
+        os.makedirs(OVERLAY_DIR, exist_ok=True)
+        with _write_lock:
+            tmp_path = path + f".{os.getpid()}.part"
+            Image.fromarray(rgba, "RGBA").save(tmp_path, format="PNG")
+            os.replace(tmp_path, path)
+    return path, rgba
+
+
+def overlay_position(frame_size, overlay_size):
+    """Top-left corner of a caption: horizontally centered at the configured top offset"""
+    return int((frame_size[0] - overlay_size[0]) / 2), TEXT_STYLE["top"]
+
+
+@lru_cache(maxsize=256)
+def _blend_planes(text, frame_width):
+    """Precomputed premultiplied colour and inverse alpha of a caption"""
+    _, rgba = get_overlay(text, frame_width)
+    alpha = rgba[..., 3:4].astype(np.float32) / 255
+    return rgba[..., :3].astype(np.float32) * alpha, 1 - alpha
+
+
+def blend_overlay(frame, text):
+    """Alpha-blend a cached caption onto a frame, touching only its bounding box"""
+    height, width = frame.shape[:2]
+    premultiplied, inverse_alpha = _blend_planes(text, width)
+    x, y = overlay_position((width, height), (premultiplied.shape[1], premultiplied.shape[0]))
+
+    # Clip the box to the frame
+    x0, y0 = max(x, 0), max(y, 0)
+    x1 = min(x + premultiplied.shape[1], width)
+    y1 = min(y + premultiplied.shape[0], height)
+    if x0 >= x1 or y0 >= y1:
+        return frame
+
+    out = frame.copy()
+    box = out[y0:y1, x0:x1].astype(np.float32)
+    src = (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+    out[y0:y1, x0:x1] = (box * inverse_alpha[src] + premultiplied[src]).round().astype(np.uint8)
+    return out
@@ -0,0 +1,86 @@
+"""Delivery of finished batches: a stored ZIP, individual files or a manifest.
+
+MP4s are already compressed, so archive entries are stored, not deflated, and
+each video is appended to the job's archive as soon as it finishes rendering
+instead of in one pass at the end. Large batches can skip the archive entirely.
+"""
+import json
+import os
+import tempfile
+import zipfile
+
+DELIVERY_ZIP = "zip"
+DELIVERY_FILES = "files"
+DELIVERY_MANIFEST = "manifest"
+DELIVERY_LABELS = {
+    DELIVERY_ZIP: "ZIP archive (built as videos finish)",
+    DELIVERY_FILES: "Individual files",
+    DELIVERY_MANIFEST: "Manifest of output paths only",
+}
+
+ARCHIVE_DIR = os.environ.get(
+    "VIDEO_EDITOR_ARCHIVE_DIR",
+    os.path.join(tempfile.gettempdir(), "auto_video_editor", "archives"),
+)
+# Browser downloads are held in server memory; larger files are only offered by path
+MAX_DOWNLOAD_BYTES = int(os.environ.get("VIDEO_EDITOR_MAX_DOWNLOAD_MB", "512")) * 1024 * 1024
+
+
+def output_name(result):
+    """File name a combined video is delivered under"""
+    return f"combined_{result['index'] + 1:03d}.mp4"
+
+
+def archive_path(job_id):
+    """Location of a job's ZIP archive"""
+    return os.path.join(ARCHIVE_DIR, f"{os.path.basename(job_id)}.zip")
+
+
+def add_to_archive(zip_path, file_path, arcname):
+    """Append one video to an archive as a stored (uncompressed) entry"""
+    os.makedirs(os.path.dirname(zip_path), exist_ok=True)
+    with zipfile.ZipFile(zip_path, "a", compression=zipfile.ZIP_STORED) as zipf:
+        if arcname not in zipf.namelist():
+            zipf.write(file_path, arcname=arcname)
+    return zip_path
+
+
+def build_archive(zip_path, results):
+    """Add every finished video of a job that is not in its archive yet"""
+    for result in sorted(results, key=lambda r: r["index"]):
+        if not result["error"] and os.path.exists(result["output_path"]):
+            add_to_archive(zip_path, result["output_path"], output_name(result))
+    return zip_path
+
+
+def repair_archive(zip_path, results):
+    """Rebuild an archive that cannot be read (e.g. an append cut short by a crash)"""
+    if os.path.exists(zip_path):
+        try:
+            with zipfile.ZipFile(zip_path) as zipf:
+                zipf.namelist()
+            return zip_path
+        except zipfile.BadZipFile:
+            os.remove(zip_path)
+    return build_archive(zip_path, results)
+
+
+def manifest(results):
+    """Machine-readable list of a job's finished videos and where they are on disk"""
+    return [
+        {
+            "sequence": result["index"] + 1,
+            "name": output_name(result),
+            "path": result["output_path"],
+            "bytes": os.path.getsize(result["output_path"]),
+            "backend": result["backend"],
+            "seconds": round(result["seconds"], 3),
+        }
+        for result in sorted(results, key=lambda r: r["index"])
+        if not result["error"] and os.path.exists(result["output_path"])
+    ]
+
+
+def manifest_json(results):
+    """The manifest as a JSON document"""
+    return json.dumps(manifest(results), indent=2)
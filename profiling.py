@@ -0,0 +1,270 @@
+"""Per-stage timing of renders: wall and CPU time, throughput and peak memory.
+
+A profile is started for each combined video on the thread that renders it.
+Code on that thread wraps its work in stage() blocks; nested stages are
+subtracted from their parent so every second is counted once. Time spent in an
+ffmpeg child process is added to the stage that ran it. Peak memory is the
+largest RSS sampled at the render's stage boundaries (or an ffmpeg child's peak),
+so it covers only the time the video was rendering. Outside a profile, stage()
+does nothing, so instrumented code costs nothing when not rendering.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+import psutil
+
+PROBE = "probe"
+DECODE = "decode"
+RESIZE = "resize"
+RASTERIZE = "text rasterization"
+COMPOSITE = "compositing"
+ENCODE = "encode"
+STREAM_COPY = "stream copy"
+FILTER_GRAPH = "ffmpeg decode+filter+encode"
+MUX = "muxing"
+PACKAGE = "packaging"
+OTHER = "other"
+
+# Per-frame stages cross a boundary many times a second; sample RSS at most this often
+RSS_SAMPLE_SECONDS = 0.05
+
+_local = threading.local()
+
+
+def start():
+    """Begin profiling the current thread's render"""
+    _local.profile = {
+        "stages": {},
+        "stack": [],
+        "segment": None,
+        "child_peak_rss": 0,
+        "peak_rss": 0,
+        "rss_sampled": 0.0,
+        "wall": time.perf_counter(),
+        "cpu": time.thread_time(),
+    }
+    _sample_rss(_local.profile, force=True)
+
+
+def finish(output_seconds=0.0, fps=0.0):
+    """End the current thread's profile and return it as a JSON-friendly dict"""
+    profile = getattr(_local, "profile", None)
+    _local.profile = None
+    if profile is None:
+        return None
+    _sample_rss(profile, force=True)
+    wall = time.perf_counter() - profile["wall"]
+    child_cpu = sum(s["child_cpu"] for s in profile["stages"].values())
+    frames = round(output_seconds * fps)
+    stages = [
+        {"stage": name, "segment": segment, "wall": s["wall"], "cpu": s["cpu"] + s["child_cpu"], "count": s["count"]}
+        for (name, segment), s in profile["stages"].items()
+    ]
+    # Glue outside any stage (cache lookups, planning, bookkeeping)
+    untracked = wall - sum(s["wall"] for s in stages)
+    if untracked > 0:
+        stages.append({"stage": OTHER, "segment": None, "wall": untracked, "cpu": 0.0, "count": 1})
+    return {
+        "stages": stages,
+        "wall": wall,
+        "cpu": time.thread_time() - profile["cpu"] + child_cpu,
+        "output_seconds": output_seconds,
+        "frames": frames,
+        "fps": frames / wall if wall else 0.0,
+        "peak_rss_bytes": max(profile["peak_rss"], profile["child_peak_rss"]),
+    }
+
+
+def _sample_rss(profile, force=False):
+    """Record this process's current RSS in a profile if it is the highest seen so far"""
+    now = time.perf_counter()
+    if not force and now - profile["rss_sampled"] < RSS_SAMPLE_SECONDS:
+        return
+    profile["rss_sampled"] = now
+    profile["peak_rss"] = max(profile["peak_rss"], psutil.Process().memory_info().rss)
+
+
+@contextmanager
+def stage(name):
+    """Time a block as one stage of the current render"""
+    profile = getattr(_local, "profile", None)
+    if profile is None:
+        yield
+        return
+    _sample_rss(profile)
+    frame = {"child_wall": 0.0, "child_cpu": 0.0, "process_cpu": 0.0}
+    profile["stack"].append(frame)
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall
+        cpu = time.thread_time() - cpu
+        _sample_rss(profile)
+        profile["stack"].pop()
+        if profile["stack"]:
+            parent = profile["stack"][-1]
+            parent["child_wall"] += wall
+            parent["child_cpu"] += cpu
+        entry = profile["stages"].setdefault(
+            (name, profile["segment"]), {"wall": 0.0, "cpu": 0.0, "child_cpu": 0.0, "count": 0}
+        )
+        entry["wall"] += wall - frame["child_wall"]
+        entry["cpu"] += cpu - frame["child_cpu"]
+        entry["child_cpu"] += frame["process_cpu"]
+        entry["count"] += 1
+
+
+@contextmanager
+def segment(index):
+    """Attribute the stages inside the block to segment `index` of the video (None: unchanged)"""
+    profile = getattr(_local, "profile", None)
+    if profile is None or index is None:
+        yield
+        return
+    previous = profile["segment"]
+    profile["segment"] = index
+    try:
+        yield
+    finally:
+        profile["segment"] = previous
+
+
+def timed(name, func, index=None):
+    """Wrap a per-frame function so each call is timed as a stage (of a segment)"""
+    def wrapper(*args):
+        with segment(index), stage(name):
+            return func(*args)
+    return wrapper
+
+
+def in_segment(func, index):
+    """Wrap a frame function so every stage it runs is attributed to segment `index`"""
+    def wrapper(*args):
+        with segment(index):
+            return func(*args)
+    return wrapper
+
+
+def add_process_usage(cpu_seconds, peak_rss_bytes):
+    """Charge a finished child process's CPU time and memory to the current stage"""
+    profile = getattr(_local, "profile", None)
+    if profile is None:
+        return
+    if profile["stack"]:
+        profile["stack"][-1]["process_cpu"] += cpu_seconds
+    profile["child_peak_rss"] = max(profile["child_peak_rss"], peak_rss_bytes)
+
+
+def add_stage(profile, name, wall, cpu):
+    """Add a stage measured outside the render thread (e.g. packaging) to a finished profile"""
+    if profile is None:
+        return
+    profile["stages"].append({"stage": name, "segment": None, "wall": wall, "cpu": cpu, "count": 1})
+    profile["wall"] += wall
+    profile["cpu"] += cpu
+
+
+def stage_totals(results):
+    """Sum every stage over a batch: [{"stage", "wall", "cpu", "share"}], slowest first"""
+    totals = {}
+    for result in results:
+        for s in (result.get("profile") or {}).get("stages", []):
+            entry = totals.setdefault(s["stage"], {"stage": s["stage"], "wall": 0.0, "cpu": 0.0})
+            entry["wall"] += s["wall"]
+            entry["cpu"] += s["cpu"]
+    overall = sum(t["wall"] for t in totals.values()) or 1.0
+    for entry in totals.values():
+        entry["share"] = entry["wall"] / overall
+    return sorted(totals.values(), key=lambda t: t["wall"], reverse=True)
+
+
+def video_rows(results):
+    """One summary row per rendered video"""
+    rows = []
+    for result in sorted(results, key=lambda r: r["index"]):
+        profile = result.get("profile")
+        if not profile:
+            continue
+        rows.append({
+            "video": result["index"] + 1,
+            "backend": result["backend"],
+            "fallback": result.get("fallback", False),
+            "encoder": result.get("encoder_profile"),
+            "reused": result.get("reused", False),
+            "wall_s": round(profile["wall"], 3),
+            "cpu_s": round(profile["cpu"], 3),
+            "output_s": round(profile["output_seconds"], 3),
+            "frames": profile["frames"],
+            "fps": round(profile["fps"], 1),
+            "peak_rss_mb": round(profile["peak_rss_bytes"] / (1024 * 1024), 1),
+            "size_mb": round(result.get("output_bytes", 0) / (1024 * 1024), 2),
+        })
+    return rows
+
+
+def encoder_rows(results):
+    """Measured speed and output size per encoder profile (rendered videos only, not reused ones)"""
+    totals = {}
+    for result in results:
+        profile = result.get("profile")
+        if not profile or result.get("reused") or result["error"]:
+            continue
+        entry = totals.setdefault(result.get("encoder_profile"), {"videos": 0, "wall": 0.0, "output": 0.0, "frames": 0, "bytes": 0})
+        entry["videos"] += 1
+        entry["wall"] += profile["wall"]
+        entry["output"] += profile["output_seconds"]
+        entry["frames"] += profile["frames"]
+        entry["bytes"] += result.get("output_bytes", 0)
+    return [
+        {
+            "encoder_profile": name,
+            "videos": t["videos"],
+            "fps": round(t["frames"] / t["wall"], 1) if t["wall"] else 0.0,
+            "x_realtime": round(t["output"] / t["wall"], 2) if t["wall"] else 0.0,
+            "mb_per_output_minute": round(t["bytes"] / (1024 * 1024) / t["output"] * 60, 1) if t["output"] else 0.0,
+            "mbit_per_s": round(t["bytes"] * 8 / 1e6 / t["output"], 2) if t["output"] else 0.0,
+        }
+        for name, t in totals.items()
+    ]
+
+
+def stage_rows(results):
+    """Flat per-video, per-segment stage rows (for CSV export)"""
+    rows = []
+    for result in sorted(results, key=lambda r: r["index"]):
+        for s in (result.get("profile") or {}).get("stages", []):
+            rows.append({
+                "video": result["index"] + 1,
+                "segment": "" if s["segment"] is None else s["segment"] + 1,
+                "stage": s["stage"],
+                "wall_s": round(s["wall"], 4),
+                "cpu_s": round(s["cpu"], 4),
+                "calls": s["count"],
+            })
+    return rows
+
+
+def estimate_remaining(results, planned_output_seconds, workers):
+    """Seconds left in a batch, from measured seconds-of-output rendered per second
+
+    results are in completion order and planned_output_seconds is a list of
+    (index, seconds) for every video. The first video is left out of the rate
+    once others have finished, since it also pays warm-up costs (process start,
+    first probes and rasterizations). Returns None until a rendered (not
+    reused) video has finished.
+    """
+    rendered = [r for r in results if r.get("profile") and not r.get("reused") and not r["error"]]
+    if len(rendered) > 1:
+        rendered = rendered[1:]
+    wall = sum(r["profile"]["wall"] for r in rendered)
+    output = sum(r["profile"]["output_seconds"] for r in rendered)
+    if not wall or not output:
+        return None
+    done = {r["index"] for r in results}
+    remaining = [seconds for index, seconds in planned_output_seconds if index not in done]
+    if not remaining:
+        return 0.0
+    parallel = max(1, min(workers, len(remaining)))
+    return sum(remaining) / (output / wall) / parallel
@@ -0,0 +1,144 @@
+"""Small proxy renditions of uploads for fast sequence previews.
+
+Each render source gets a 270x480, low frame rate, ultrafast copy in the
+background as soon as it is ingested. Previews are rendered from these proxies
+with the same filter graph as the ffmpeg backend, so timings, speeds and
+captions can be checked in seconds before the full-size batch is rendered.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from moviepy.config import FFMPEG_BINARY
+
+import ffmpeg_render
+import overlays
+import upload_store
+from moviepy_render import OUTPUT_SIZE
+
+PROXY_SIZE = (270, 480)
+PROXY_FPS = 15
+MAX_WORKERS = int(os.environ.get("VIDEO_EDITOR_PROXY_WORKERS", "2"))
+PREVIEW_DIR = os.environ.get(
+    "VIDEO_EDITOR_PREVIEW_DIR",
+    os.path.join(tempfile.gettempdir(), "auto_video_editor", "previews"),
+)
+
+_futures = {}
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="proxy")
+
+
+def proxy_id(digest):
+    """Store key of a source's proxy"""
+    return f"{digest}.proxy"
+
+
+def proxy_path(digest):
+    """Location of the proxy rendition of a render source"""
+    return upload_store.store_path(proxy_id(digest), ".mp4")
+
+
+def request_proxy(digest, path, metadata):
+    """Queue a proxy transcode for a render source unless it exists, is under way or failed
+
+    A failure is remembered until retry_proxy is called.
+    """
+    with _lock:
+        if os.path.exists(proxy_path(digest)):
+            return
+        future = _futures.get(digest)
+        # A successful transcode whose proxy is gone was removed by retention; make it again
+        if future is not None and (not future.done() or future.exception() is not None):
+            return
+        _futures[digest] = _executor.submit(_transcode, digest, path, metadata)
+
+
+def retry_proxy(digest, path, metadata):
+    """Forget a failed proxy transcode and queue it again"""
+    with _lock:
+        future = _futures.get(digest)
+        if future is not None and future.done() and future.exception() is not None:
+            del _futures[digest]
+    request_proxy(digest, path, metadata)
+
+
+def get_proxy(digest, path, metadata):
+    """Return (proxy_id, path, metadata) of a source's proxy, waiting for it if needed
+
+    Previews are rendered on request, so a proxy that failed earlier is retried here.
+    """
+    retry_proxy(digest, path, metadata)
+    with _lock:
+        future = _futures.get(digest)
+    if future is not None:
+        future.result()
+    return proxy_id(digest), proxy_path(digest), upload_store.get_metadata(proxy_id(digest), proxy_path(digest))
+
+
+def build_command(path, metadata, output_path):
+    """ffmpeg arguments that make one proxy (source timeline kept, so timings still apply)"""
+    width, height = PROXY_SIZE
+    cmd = [FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error", "-i", path]
+    cmd += ["-map", "0:v:0", "-vf", f"fps={PROXY_FPS},scale={width}:{height},setsar=1"]
+    cmd += ["-c:v", "libx264", "-preset", "ultrafast", "-crf", "30", "-pix_fmt", "yuv420p"]
+    if metadata.get("has_audio"):
+        cmd += ["-map", "0:a:0", "-c:a", "aac", "-b:a", "64k", "-ac", "2", "-ar", str(ffmpeg_render.AUDIO_RATE)]
+    cmd += ["-f", "mp4", output_path]
+    return cmd
+
+
+def _transcode(digest, path, metadata):
+    """Worker: write one proxy next to its source in the upload store"""
+    tmp_path = proxy_path(digest) + ".part"
+    try:
+        ffmpeg_render.run_ffmpeg(build_command(path, metadata, tmp_path))
+        os.replace(tmp_path, proxy_path(digest))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def preview_key(segments):
+    """Identify a preview by everything that affects its picture and sound"""
+    payload = {
+        "segments": [[seg["hash"], seg["start"], seg["end"], seg["speed"], seg["text"].strip()] for seg in segments],
+        "size": list(PROXY_SIZE),
+        "fps": PROXY_FPS,
+        "style": overlays.TEXT_STYLE,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def render_preview(segments, threads=None):
+    """Render a low-resolution preview of one combined video from proxies, reusing earlier ones"""
+    output_path = os.path.join(PREVIEW_DIR, preview_key(segments) + ".mp4")
+    if os.path.exists(output_path):
+        os.utime(output_path)  # mark as recently used
+        return output_path
+
+    proxy_segments = []
+    for seg in segments:
+        digest, path, metadata = get_proxy(seg["hash"], seg["path"], seg["metadata"])
+        proxy_segments.append(dict(seg, hash=digest, path=path, metadata=metadata))
+    overlay_paths = {
+        i: overlays.get_overlay(seg["text"].strip(), OUTPUT_SIZE[0])[0]
+        for i, seg in enumerate(proxy_segments) if seg["text"].strip()
+    }
+
+    os.makedirs(PREVIEW_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=PREVIEW_DIR, suffix=".part.mp4")
+    os.close(fd)
+    try:
+        ffmpeg_render.run_ffmpeg(ffmpeg_render.build_command(
+            proxy_segments, tmp_path, overlay_paths, threads,
+            size=PROXY_SIZE, fps=PROXY_FPS, options={"encoder_profile": "draft"},
+        ))
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return output_path
@@ -0,0 +1,59 @@
+"""Render backend selection for combined videos"""
+import logging
+import os
+
+import ffmpeg_render
+import moviepy_render
+import segment_cache
+
+BACKEND_FFMPEG = "ffmpeg"
+BACKEND_SEGMENTS = "segments"
+BACKEND_MOVIEPY = "moviepy"
+BACKENDS = {
+    BACKEND_FFMPEG: ffmpeg_render,
+    BACKEND_SEGMENTS: segment_cache,
+    BACKEND_MOVIEPY: moviepy_render,
+}
+BACKEND_LABELS = {
+    BACKEND_FFMPEG: "ffmpeg (native filter graph)",
+    BACKEND_SEGMENTS: "ffmpeg + segment cache (concat without re-encode)",
+    BACKEND_MOVIEPY: "MoviePy (per-frame)",
+}
+DEFAULT_BACKEND = os.environ.get("VIDEO_EDITOR_RENDER_BACKEND", BACKEND_FFMPEG)
+
+logger = logging.getLogger(__name__)
+
+
+def validate_segments(segments):
+    """Raise ValueError for a segment no backend can render (e.g. an empty window)"""
+    for i, seg in enumerate(segments):
+        try:
+            ffmpeg_render.segment_window(seg)
+        except ValueError as e:
+            raise ValueError(f"Segment {i + 1} ({seg.get('label')}: {seg.get('filename')}): {e}") from None
+
+
+def render_sequence(segments, output_path, backend=DEFAULT_BACKEND, threads=None, options=None):
+    """Render segments to output_path and return the backend that produced it
+
+    options holds backend-specific settings (e.g. stream copy for the segment cache).
+    The native backends fall back to MoviePy if ffmpeg fails at run time; bad
+    segments are reported instead, since every backend would fail on them.
+    """
+    if not segments:
+        raise ValueError("No segments to render")
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown render backend: {backend}")
+    validate_segments(segments)
+
+    if backend != BACKEND_MOVIEPY:
+        try:
+            BACKENDS[backend].render_segments(segments, output_path, threads, options)
+            return backend
+        except (RuntimeError, OSError) as e:
+            # A canceled render must not start again on the (uncancelable) MoviePy path
+            ffmpeg_render.check_canceled()
+            logger.warning("%s render failed, falling back to MoviePy: %s", backend, e)
+
+    moviepy_render.render_segments(segments, output_path, threads, options)
+    return BACKEND_MOVIEPY
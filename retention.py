@@ -0,0 +1,157 @@
+"""Disk retention for everything the app stores: quotas, age limits and usage.
+
+Each storage area (uploads with their mezzanines, proxies and sidecars; cached
+segments; rasterized captions; stored outputs; previews; job workspaces;
+archives) has a byte quota.
+Files are grouped by the key before their first dot, so a video and everything
+derived from or describing it are removed together. Groups unused for longer
+than MAX_AGE_DAYS go first, then the least recently used until the area fits.
+Anything touched within GRACE_SECONDS or still needed by a running job is kept;
+partial files older than that are leftovers of a crash and are always removed.
+"""
+import os
+import shutil
+import tempfile
+import time
+
+import jobs
+import output_cache
+import overlays
+import packager
+import proxy
+import segment_cache
+import upload_store
+
+MB = 1024 * 1024
+MAX_AGE_DAYS = float(os.environ.get("VIDEO_EDITOR_MAX_AGE_DAYS", "7"))
+GRACE_SECONDS = 15 * 60
+
+# name: (directory, quota in bytes); outputs come before jobs, so a video linked
+# into a job workspace counts as an output
+AREAS = {
+    "uploads": (upload_store.STORE_DIR, int(os.environ.get("VIDEO_EDITOR_UPLOAD_QUOTA_MB", "20480")) * MB),
+    "segments": (segment_cache.CACHE_DIR, segment_cache.MAX_CACHE_BYTES),
+    "overlays": (overlays.OVERLAY_DIR, int(os.environ.get("VIDEO_EDITOR_OVERLAY_QUOTA_MB", "512")) * MB),
+    "outputs": (output_cache.OUTPUT_DIR, int(os.environ.get("VIDEO_EDITOR_OUTPUT_QUOTA_MB", "10240")) * MB),
+    "previews": (proxy.PREVIEW_DIR, int(os.environ.get("VIDEO_EDITOR_PREVIEW_QUOTA_MB", "1024")) * MB),
+    "jobs": (jobs.JOBS_DIR, int(os.environ.get("VIDEO_EDITOR_JOBS_QUOTA_MB", "10240")) * MB),
+    "archives": (packager.ARCHIVE_DIR, int(os.environ.get("VIDEO_EDITOR_ARCHIVE_QUOTA_MB", "10240")) * MB),
+}
+
+
+def _file_size(stat, seen):
+    """Bytes a file adds, counting a hard-linked inode only the first time it is seen"""
+    if stat.st_nlink > 1:
+        inode = (stat.st_dev, stat.st_ino)
+        if inode in seen:
+            return 0
+        seen.add(inode)
+    return stat.st_size
+
+
+def _entry_size(entry, seen):
+    """Bytes used by a file, or by everything under a directory"""
+    if not entry.is_dir(follow_symlinks=False):
+        return _file_size(entry.stat(follow_symlinks=False), seen)
+    total = 0
+    for root, _, files in os.walk(entry.path):
+        for name in files:
+            try:
+                total += _file_size(os.lstat(os.path.join(root, name)), seen)
+            except FileNotFoundError:
+                continue
+    return total
+
+
+def _remove(path):
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def scan(directory, seen=None):
+    """Group an area's files by key: {key: {"paths", "bytes", "last_used"}}
+
+    Finished videos are hard-linked between outputs and job workspaces; seen
+    holds the inodes already counted in other areas, so their bytes count once.
+    """
+    seen = set() if seen is None else seen
+    groups = {}
+    if not os.path.isdir(directory):
+        return groups
+    for entry in os.scandir(directory):
+        try:
+            size = _entry_size(entry, seen)
+            mtime = entry.stat(follow_symlinks=False).st_mtime
+        except FileNotFoundError:
+            continue
+        group = groups.setdefault(entry.name.split(".")[0], {"paths": [], "bytes": 0, "last_used": 0.0})
+        group["paths"].append(entry.path)
+        group["bytes"] += size
+        group["last_used"] = max(group["last_used"], mtime)
+    return groups
+
+
+def usage():
+    """Files and bytes per area, with each area's quota"""
+    rows = []
+    seen = set()
+    for name, (directory, quota) in AREAS.items():
+        groups = scan(directory, seen).values()
+        rows.append({
+            "area": name,
+            "directory": directory,
+            "items": len(groups),
+            "bytes": sum(g["bytes"] for g in groups),
+            "quota_bytes": quota,
+        })
+    return rows
+
+
+def disk_free():
+    """(total, free) bytes of the disk the app stores its files on"""
+    usage = shutil.disk_usage(tempfile.gettempdir())
+    return usage.total, usage.free
+
+
+def enforce(max_age_days=MAX_AGE_DAYS, now=None):
+    """Apply age limits and quotas to every area; returns the bytes freed"""
+    now = now or time.time()
+    protected = jobs.active_references() | segment_cache.keys_in_use()
+    freed = 0
+    seen = set()
+    for name, (directory, quota) in AREAS.items():
+        freed += _remove_stale_parts(directory, now)
+        groups = scan(directory, seen)
+        total = sum(g["bytes"] for g in groups.values())
+        for key, group in sorted(groups.items(), key=lambda item: item[1]["last_used"]):
+            expired = now - group["last_used"] > max_age_days * 86400
+            if not expired and total <= quota:
+                break
+            if key in protected or now - group["last_used"] < GRACE_SECONDS:
+                continue
+            for path in group["paths"]:
+                _remove(path)
+            total -= group["bytes"]
+            freed += group["bytes"]
+    return freed
+
+
+def _remove_stale_parts(directory, now):
+    """Delete partial files that no writer has touched within the grace period"""
+    freed = 0
+    if not os.path.isdir(directory):
+        return freed
+    for entry in os.scandir(directory):
+        try:
+            if ".part" in entry.name and entry.is_file() and now - entry.stat().st_mtime > GRACE_SECONDS:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                freed += size
+        except FileNotFoundError:
+            continue
+    return freed
@@ -0,0 +1,236 @@
+"""On-disk cache of rendered segments, concatenated without re-encoding.
+
+Each unique (source, timing, speed, text, output format) segment is encoded once
+to an intermediate MP4 with uniform stream parameters, so any combination of
+cached segments can be joined with the concat demuxer (-c copy). Least recently
+used segments are evicted once the cache grows past its size budget.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import Counter
+
+from moviepy.config import FFMPEG_BINARY
+
+import encoder_profiles
+import ffmpeg_render
+import overlays
+import profiling
+import stream_copy
+from moviepy_render import OUTPUT_SIZE
+
+CACHE_DIR = os.environ.get(
+    "VIDEO_EDITOR_SEGMENT_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "auto_video_editor", "segments"),
+)
+MAX_CACHE_BYTES = int(os.environ.get("VIDEO_EDITOR_SEGMENT_CACHE_MB", "5120")) * 1024 * 1024
+
+# Every cached segment shares these so they can be stream-copied together
+SEGMENT_FPS = 30
+VIDEO_TIMESCALE = 90000
+# Bump when the encoding settings below change so old segments are not mixed in
+FORMAT_VERSION = 2
+
+_lock = threading.Lock()
+_key_locks = {}
+_in_use = Counter()
+
+
+def segment_key(segment, copy_window=None, options=None):
+    """Cache key for everything that affects a segment's pixels and samples"""
+    if copy_window:
+        # A stream-copied cut depends only on the source and the (keyframe-aligned) window
+        payload = {"source": segment["hash"], "copy": [round(t, 3) for t in copy_window], "version": FORMAT_VERSION}
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    payload = {
+        "source": segment["hash"],
+        "start": segment["start"],
+        "end": segment["end"],
+        "speed": segment["speed"],
+        "text": segment["text"].strip(),
+        "size": list(OUTPUT_SIZE),
+        "fps": SEGMENT_FPS,
+        "encoder": encoder_profiles.encoder_settings(options),
+        "version": FORMAT_VERSION,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def segment_path(key):
+    """Location of a cached segment"""
+    return os.path.join(CACHE_DIR, key + ".mp4")
+
+
+def build_segment_command(segment, output_path, overlay_path=None, threads=None, options=None):
+    """ffmpeg arguments that encode one segment in the shared intermediate format"""
+    width, height = OUTPUT_SIZE
+    start, window = ffmpeg_render.segment_window(segment)
+    duration = window / segment["speed"]
+    has_audio = segment.get("metadata", {}).get("has_audio")
+
+    cmd = [FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error"]
+    if threads:
+        cmd += ["-threads", str(threads)]
+    cmd += ["-ss", f"{start:.3f}", "-t", f"{window:.3f}", "-i", segment["path"]]
+    if overlay_path:
+        cmd += ["-i", overlay_path]
+    if not has_audio:
+        cmd += ["-f", "lavfi", "-t", f"{duration:.3f}", "-i", f"anullsrc=r={ffmpeg_render.AUDIO_RATE}:cl=stereo"]
+    audio_input = 0 if has_audio else (2 if overlay_path else 1)
+
+    chain = f"[0:v]{ffmpeg_render.speed_video_filters(segment['speed'], SEGMENT_FPS)},scale={width}:{height},setsar=1"
+    if overlay_path:
+        chain += f"[base];[base][1:v]overlay=x=(W-w)/2:y={overlays.TEXT_STYLE['top']}"
+    filters = [
+        chain + "[vout]",
+        f"[{audio_input}:a]{ffmpeg_render.speed_audio_filters(segment['speed']) if has_audio else ''}"
+        f"aresample={ffmpeg_render.AUDIO_RATE},aformat=sample_fmts=fltp:channel_layouts=stereo,"
+        f"apad,atrim=0:{duration:.3f},asetpts=PTS-STARTPTS[aout]",
+    ]
+
+    cmd += ["-filter_complex", ";".join(filters), "-map", "[vout]", "-map", "[aout]", "-t", f"{duration:.3f}"]
+    cmd += ["-c:v", "libx264"] + encoder_profiles.video_args(options, SEGMENT_FPS)
+    cmd += ["-pix_fmt", "yuv420p", "-video_track_timescale", str(VIDEO_TIMESCALE)]
+    cmd += ["-c:a", "aac", "-ar", str(ffmpeg_render.AUDIO_RATE), "-ac", "2"] + encoder_profiles.audio_args(options)
+    if threads:
+        cmd += ["-threads", str(threads)]
+    cmd += ["-f", "mp4", output_path]
+    return cmd
+
+
+def encode_segment(segment, output_path, threads=None, options=None):
+    """Encode a single segment to output_path"""
+    overlay_path = None
+    if segment["text"].strip():
+        overlay_path = overlays.get_overlay(segment["text"].strip(), OUTPUT_SIZE[0])[0]
+    with profiling.stage(profiling.ENCODE):
+        ffmpeg_render.run_ffmpeg(build_segment_command(segment, output_path, overlay_path, threads, options))
+    return output_path
+
+
+def plan_segment(segment, options=None):
+    """Decide whether a segment is stream-copied (returns its window) or encoded (None)"""
+    options = options or {}
+    if not options.get("stream_copy", True):
+        return None
+    return stream_copy.plan_copy(segment, SEGMENT_FPS, options.get("snap_to_keyframes", False))
+
+
+def get_segment(segment, threads=None, copy_window=None, options=None):
+    """Return the path of a cached segment, cutting or encoding it on first use"""
+    key = segment_key(segment, copy_window, options)
+    path = segment_path(key)
+    with _lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+
+    # Workers asking for the same segment wait for one encode instead of racing
+    with key_lock:
+        if os.path.exists(path):
+            os.utime(path)  # mark as recently used
+            return path
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".part")
+        os.close(fd)
+        try:
+            if copy_window:
+                with profiling.stage(profiling.STREAM_COPY):
+                    stream_copy.copy_cut(segment["path"], copy_window[0], copy_window[1], tmp_path, VIDEO_TIMESCALE)
+            else:
+                encode_segment(segment, tmp_path, threads, options)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    evict()
+    return path
+
+
+def concat_segments(segment_paths, output_path, durations=None):
+    """Join cached segments with the concat demuxer, copying streams
+
+    Stream-copied cuts end on packet boundaries, so they run a little long
+    (an AAC frame, or trailing B-frames). With durations, each segment is cut at
+    its planned length and the next one starts exactly there, so the combined
+    video keeps its planned frame count and length (within an audio frame).
+    Sources with B-frames start their copied cut a frame or two late (the
+    reorder delay), so one frame at such a join can share a timestamp with the
+    next segment's first frame; players show it for one frame less.
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as listing:
+        for i, path in enumerate(segment_paths):
+            listing.write(f"file '{path}'\n")
+            if durations:
+                listing.write(f"outpoint {durations[i]:.6f}\nduration {durations[i]:.6f}\n")
+    try:
+        with profiling.stage(profiling.MUX):
+            ffmpeg_render.run_ffmpeg([
+                FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error",
+                "-f", "concat", "-safe", "0", "-i", listing.name,
+                "-c", "copy", "-movflags", "+faststart", output_path,
+            ])
+    finally:
+        os.remove(listing.name)
+    return output_path
+
+
+def render_segments(segments, output_path, threads=None, options=None):
+    """Render a sequence from cached segments (cutting or encoding only the missing ones)"""
+    copy_windows = []
+    for i, seg in enumerate(segments):
+        with profiling.segment(i):
+            copy_windows.append(plan_segment(seg, options))
+    keys = [segment_key(seg, window, options) for seg, window in zip(segments, copy_windows)]
+    with _lock:
+        _in_use.update(keys)
+    try:
+        paths = []
+        for i, (seg, window) in enumerate(zip(segments, copy_windows)):
+            with profiling.segment(i):
+                paths.append(get_segment(seg, threads, window, options))
+        durations = [
+            window[1] if window else ffmpeg_render.played_duration(seg)
+            for seg, window in zip(segments, copy_windows)
+        ]
+        return concat_segments(paths, output_path, durations)
+    finally:
+        with _lock:
+            for key in keys:
+                _in_use[key] -= 1
+                if _in_use[key] <= 0:
+                    del _in_use[key]
+
+
+def keys_in_use():
+    """Keys of segments that renders are reading right now"""
+    with _lock:
+        return set(_in_use)
+
+
+def cache_usage():
+    """Return (number of segments, total bytes) currently cached"""
+    if not os.path.isdir(CACHE_DIR):
+        return 0, 0
+    sizes = [entry.stat().st_size for entry in os.scandir(CACHE_DIR) if entry.name.endswith(".mp4")]
+    return len(sizes), sum(sizes)
+
+
+def evict(max_bytes=MAX_CACHE_BYTES):
+    """Delete least recently used segments until the cache fits in max_bytes"""
+    if not os.path.isdir(CACHE_DIR):
+        return
+    entries = [entry for entry in os.scandir(CACHE_DIR) if entry.name.endswith(".mp4")]
+    total = sum(entry.stat().st_size for entry in entries)
+    for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+        if total <= max_bytes:
+            break
+        with _lock:
+            if entry.name[:-len(".mp4")] in _in_use:
+                continue
+        try:
+            size = entry.stat().st_size
+            os.remove(entry.path)
+            total -= size
+        except FileNotFoundError:
+            continue
@@ -0,0 +1,105 @@
+"""Smart selection of sources for combined videos, from an in-memory metadata index.
+
+Everything a pick needs (dimensions, frame rate, codecs, duration, audio and a
+perceptual thumbnail hash) is collected once at ingest, so generating even
+hundreds of sequences never opens a file. Within a sequence, sources that match
+the first pick's shape and frame rate are favored, near-duplicate shots are
+avoided, and sources that already match the output (no resize, or even a plain
+stream copy) get extra weight. Picks are weighted rather than greedy, and
+repeatedly used sources are weighted down, so batches stay varied; the same
+seed and uploads always give the same sequences.
+"""
+import stream_copy
+from moviepy_render import OUTPUT_SIZE
+from segment_cache import SEGMENT_FPS
+
+# Thumbnail hashes this close (differing bits out of 64) are treated as the same shot
+NEAR_DUPLICATE_BITS = 10
+ASPECT_TOLERANCE = 0.02
+
+NO_RESIZE_WEIGHT = 2.0
+STREAM_COPY_WEIGHT = 1.5
+SAME_SHAPE_WEIGHT = 3.0
+SAME_FPS_WEIGHT = 1.5
+NEAR_DUPLICATE_WEIGHT = 0.02
+
+
+def index_entry(metadata, thumbnail_hash=None):
+    """The fields selection reads for one source"""
+    width, height = metadata.get("width") or 0, metadata.get("height") or 0
+    return {
+        "width": width,
+        "height": height,
+        "aspect": width / height if height else 0.0,
+        "fps": metadata.get("fps") or 0.0,
+        "codec": metadata.get("video_codec"),
+        "duration": metadata.get("duration") or 0.0,
+        "has_audio": bool(metadata.get("has_audio")),
+        "dhash": int(thumbnail_hash, 16) if thumbnail_hash else None,
+        "no_resize": (width, height) == tuple(OUTPUT_SIZE),
+        "stream_copy": stream_copy.is_copy_compatible(metadata, SEGMENT_FPS),
+    }
+
+
+def build_index(video_params):
+    """{label: [entry, ...]} in the same order as each group's paths"""
+    index = {}
+    for label, data in video_params.items():
+        hashes = data.get("thumbnail_hashes") or [None] * len(data["paths"])
+        index[label] = [index_entry(m, h) for m, h in zip(data["metadata"], hashes)]
+    return index
+
+
+def near_duplicate(a, b):
+    """Whether two sources show the same shot, judged by their thumbnail hashes"""
+    if a["dhash"] is None or b["dhash"] is None:
+        return False
+    return bin(a["dhash"] ^ b["dhash"]).count("1") <= NEAR_DUPLICATE_BITS
+
+
+def base_weight(entry):
+    """Weight of a source on its own: cheaper render paths are favored"""
+    if entry["duration"] <= 0:
+        return 0.0
+    weight = 1.0
+    if entry["no_resize"]:
+        weight *= NO_RESIZE_WEIGHT
+    if entry["stream_copy"]:
+        weight *= STREAM_COPY_WEIGHT
+    return weight
+
+
+def pick_weight(entry, base, picked, uses):
+    """Weight of a source given the sources already picked for this sequence"""
+    weight = base / (1 + uses)
+    if picked:
+        anchor = picked[0]
+        if anchor["aspect"] and abs(entry["aspect"] - anchor["aspect"]) <= ASPECT_TOLERANCE * anchor["aspect"]:
+            weight *= SAME_SHAPE_WEIGHT
+        if abs(entry["fps"] - anchor["fps"]) < 0.01:
+            weight *= SAME_FPS_WEIGHT
+        if any(near_duplicate(entry, other) for other in picked):
+            weight *= NEAR_DUPLICATE_WEIGHT
+    return weight
+
+
+def select_sequences(index, num_videos_to_generate, rng):
+    """Pick one source per group for every sequence: [{label: position}, ...]"""
+    base = {label: [base_weight(e) for e in entries] for label, entries in index.items()}
+    uses = {label: [0] * len(entries) for label, entries in index.items()}
+    sequences = []
+    for _ in range(num_videos_to_generate):
+        picked = []
+        choice = {}
+        for label, entries in index.items():
+            if not entries:
+                continue
+            weights = [pick_weight(e, b, picked, u) for e, b, u in zip(entries, base[label], uses[label])]
+            if not any(weights):  # nothing usable (e.g. unreadable durations): fall back to uniform
+                weights = [1.0] * len(entries)
+            position = rng.choices(range(len(entries)), weights)[0]
+            choice[label] = position
+            picked.append(entries[position])
+            uses[label][position] += 1
+        sequences.append(choice)
+    return sequences
@@ -0,0 +1,66 @@
+"""Stream-copy fast path for segments that need no re-encode.
+
+A segment qualifies when it plays at normal speed without a caption and its
+source already matches the segment cache's intermediate format. Such a segment
+is cut at a keyframe with -c copy, which runs at disk speed, and can then be
+joined with encoded segments by the concat demuxer.
+"""
+from moviepy.config import FFMPEG_BINARY
+
+import ffmpeg_render
+import upload_store
+from moviepy_render import OUTPUT_SIZE
+
+
+def is_copy_compatible(metadata, fps):
+    """Whether a source's streams can be copied into a combined video unchanged"""
+    return (
+        metadata.get("video_codec") == "h264"
+        and metadata.get("pix_fmt") == "yuv420p"
+        and (metadata.get("width"), metadata.get("height")) == tuple(OUTPUT_SIZE)
+        and not metadata.get("rotation")
+        # The concat demuxer drops display matrices, so any transform would be lost
+        and not metadata.get("display_matrix")
+        and abs((metadata.get("fps") or 0) - fps) < 0.01
+        and metadata.get("has_audio")
+        and metadata.get("audio_codec") == "aac"
+        and metadata.get("audio_fps") == ffmpeg_render.AUDIO_RATE
+        and metadata.get("audio_channels") == "stereo"
+    )
+
+
+def plan_copy(segment, fps, snap_to_keyframes=False):
+    """Return the (start, duration) to stream-copy for a segment, or None if it must be encoded
+
+    Without snapping, only segments that already start on a keyframe qualify.
+    With snapping, the window is moved to the nearest keyframe (keeping its length).
+    """
+    metadata = segment.get("metadata", {})
+    if segment["speed"] != 1.0 or segment["text"].strip() or not is_copy_compatible(metadata, fps):
+        return None
+
+    start, duration = ffmpeg_render.segment_window(segment)
+    keyframes = upload_store.get_keyframes(segment["hash"], segment["path"])
+    if not keyframes:
+        return None
+    nearest = min(keyframes, key=lambda k: abs(k - start))
+    if abs(nearest - start) <= 0.5 / fps:
+        return nearest, duration
+    if not snap_to_keyframes:
+        return None
+    duration = min(duration, metadata["duration"] - 0.01 - nearest)
+    if duration <= 0:
+        return None
+    return nearest, duration
+
+
+def copy_cut(path, start, duration, output_path, timescale):
+    """Cut [start, start + duration) from a source without re-encoding"""
+    ffmpeg_render.run_ffmpeg([
+        FFMPEG_BINARY, "-y", "-hide_banner", "-loglevel", "error",
+        "-ss", f"{start:.3f}", "-i", path, "-t", f"{duration:.3f}",
+        "-map", "0:v:0", "-map", "0:a:0", "-c", "copy",
+        "-avoid_negative_ts", "make_zero", "-video_track_timescale", str(timescale),
+        "-f", "mp4", output_path,
+    ])
+    return output_path
@@ -0,0 +1,329 @@
+"""Content-addressed store for uploaded source videos.
+
+Every upload is written once under the SHA-256 of its contents and probed once;
+the probe result is kept in memory and in a JSON sidecar next to the video so
+Streamlit reruns (and server restarts) can skip both the disk write and ffmpeg.
+Uploads are hashed and copied in fixed-size chunks, so ingesting a multi-GB
+file never needs a second whole-file copy in memory.
+"""
+import hashlib
+import json
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+
+import psutil
+
+from moviepy.config import FFMPEG_BINARY
+from moviepy.video.io.ffmpeg_reader import FFmpegInfosParser
+
+import profiling
+
+STORE_DIR = os.environ.get(
+    "VIDEO_EDITOR_STORE_DIR",
+    os.path.join(tempfile.gettempdir(), "auto_video_editor", "uploads"),
+)
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Bump whenever probe_video() starts returning new fields so stale sidecars are re-probed
+PROBE_VERSION = 3
+
+# Thumbnail grid for the difference hash: one bit per horizontally adjacent pixel pair
+DHASH_SIZE = 8
+
+# Details FFmpegInfosParser does not extract from the `ffmpeg -i` banner
+VIDEO_STREAM_RE = re.compile(r"Stream #\d+:\d+.*?: Video: (\w+)[^,]*, (\w+)")
+AUDIO_STREAM_RE = re.compile(r"Stream #\d+:\d+.*?: Audio: (\w+)[^,]*, (\d+) Hz, ([\w.()]+)")
+KEYFRAME_RE = re.compile(r"pts_time:\s*([\d.]+)")
+# ffmpeg 5+ reports rotation as stream side data instead of a "rotate" metadata tag
+DISPLAYMATRIX_RE = re.compile(r"displaymatrix:(?: rotation of (-?[\d.]+) degrees)?")
+
+_metadata_cache = {}
+_keyframe_cache = {}
+_thumbnail_cache = {}
+_lock = threading.Lock()
+
+
+def content_hash(data):
+    """Return the hex digest used to address a piece of content"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def store_path(digest, ext=".mp4"):
+    """Path of the stored video for a content hash"""
+    return os.path.join(STORE_DIR, digest + ext)
+
+
+def store_upload(file):
+    """Write an uploaded file into the store (once) and return its record"""
+    filename = os.path.basename(file.name) if hasattr(file, "name") else "upload.mp4"
+    ext = os.path.splitext(filename)[1].lower() or ".mp4"
+
+    started = time.time()
+    rss = psutil.Process().memory_info().rss
+    memory = {"baseline": rss, "peak": rss}
+    if file.seekable():
+        file.seek(0)
+        digest, size = _ingest_seekable(file, ext, memory)
+    else:
+        digest, size = _ingest_stream(file, ext, memory)
+    elapsed = time.time() - started
+
+    path = store_path(digest, ext)
+    metadata = get_metadata(digest, path)
+    return {
+        "hash": digest,
+        "path": path,
+        "filename": filename,
+        "metadata": metadata,
+        "thumbnail_hash": get_thumbnail_hash(digest, path, metadata["duration"]),
+        "ingest": {
+            "bytes": size,
+            "seconds": elapsed,
+            # Sampled per chunk; RSS is process-wide, so sessions ingesting at the
+            # same time add to each other's growth
+            "peak_rss_bytes": memory["peak"],
+            "rss_growth_bytes": max(0, memory["peak"] - memory["baseline"]),
+        },
+    }
+
+
+def _ingest_seekable(file, ext, memory=None):
+    """Hash a seekable upload in chunks, then copy it only if it is not stored yet"""
+    hasher = hashlib.sha256()
+    size = 0
+    for chunk in _iter_chunks(file, memory):
+        hasher.update(chunk)
+        size += len(chunk)
+    digest = hasher.hexdigest()
+
+    if os.path.exists(store_path(digest, ext)):
+        os.utime(store_path(digest, ext))  # mark as recently used
+    else:
+        file.seek(0)
+        tmp_path = _new_part_file()
+        try:
+            with open(tmp_path, "wb") as out:
+                for chunk in _iter_chunks(file, memory):
+                    out.write(chunk)
+            os.replace(tmp_path, store_path(digest, ext))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return digest, size
+
+
+def _ingest_stream(file, ext, memory=None):
+    """Copy a non-seekable upload in bounded chunks, hashing as it is written"""
+    hasher = hashlib.sha256()
+    size = 0
+    tmp_path = _new_part_file()
+    try:
+        with open(tmp_path, "wb") as out:
+            for chunk in _iter_chunks(file, memory):
+                hasher.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        digest = hasher.hexdigest()
+        if os.path.exists(store_path(digest, ext)):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, store_path(digest, ext))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest, size
+
+
+def _iter_chunks(file, memory=None):
+    """Yield views of one reused buffer, so at most CHUNK_SIZE bytes are held at a time
+
+    readinto() is used rather than getbuffer(): Streamlit's uploads are BytesIO
+    objects sharing their bytes, and exporting a buffer would force a full copy.
+    With memory ({"peak": bytes}), the process RSS is sampled after every chunk.
+    """
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    process = psutil.Process()
+    while True:
+        n = file.readinto(buffer)
+        if memory is not None:
+            memory["peak"] = max(memory["peak"], process.memory_info().rss)
+        if not n:
+            break
+        yield view[:n]
+
+
+def _new_part_file():
+    """Private temp name inside the store so concurrent sessions never see a partial file"""
+    os.makedirs(STORE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=STORE_DIR, suffix=".part")
+    os.close(fd)
+    return tmp_path
+
+
+def get_metadata(digest, path):
+    """Return cached probe metadata for a stored video, probing it on first use"""
+    with _lock:
+        if digest in _metadata_cache:
+            return _metadata_cache[digest]
+
+    sidecar = os.path.join(STORE_DIR, digest + ".json")
+    metadata = None
+    if os.path.exists(sidecar):
+        try:
+            with open(sidecar) as f:
+                cached = json.load(f)
+            if cached.get("probe_version") == PROBE_VERSION:
+                metadata = cached
+        except (OSError, ValueError):
+            metadata = None
+
+    if metadata is None:
+        with profiling.stage(profiling.PROBE):
+            metadata = probe_video(path)
+        metadata["probe_version"] = PROBE_VERSION
+        with open(sidecar, "w") as f:
+            json.dump(metadata, f)
+
+    with _lock:
+        _metadata_cache[digest] = metadata
+    return metadata
+
+
+def probe_video(path):
+    """Read container metadata with a single `ffmpeg -i` call (no decoder is opened)"""
+    result = subprocess.run(
+        [FFMPEG_BINARY, "-hide_banner", "-i", path],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    banner = result.stderr.decode("utf8", errors="ignore")
+    infos = FFmpegInfosParser(banner, path).parse()
+    width, height = infos.get("video_size") or (0, 0)
+    video_stream = VIDEO_STREAM_RE.search(banner)
+    display_matrix = _display_matrix(banner, video_stream)
+    if display_matrix is not None:
+        rotation = round(float(display_matrix.group(1) or 0)) % 360
+    else:
+        rotation = round(infos.get("video_rotation", 0) or 0) % 360
+    if rotation in (90, 270):
+        # ffmpeg auto-rotates on decode, so report the displayed orientation
+        width, height = height, width
+    audio_stream = AUDIO_STREAM_RE.search(banner)
+
+    return {
+        "duration": infos.get("duration") or 0.0,
+        "fps": infos.get("video_fps") or 0.0,
+        "width": width,
+        "height": height,
+        "rotation": rotation,
+        "display_matrix": display_matrix is not None,
+        "has_audio": bool(infos.get("audio_found")),
+        "audio_fps": infos.get("audio_fps"),
+        "video_codec": infos.get("video_codec_name"),
+        "pix_fmt": video_stream.group(2) if video_stream else None,
+        "audio_codec": audio_stream.group(1) if audio_stream else None,
+        "audio_channels": audio_stream.group(3) if audio_stream else None,
+        "n_frames": infos.get("video_n_frames"),
+    }
+
+
+def _display_matrix(banner, video_stream):
+    """The displaymatrix side data of the first video stream, if it has any"""
+    if video_stream is None:
+        return None
+    following = banner.find("Stream #", video_stream.end())
+    block = banner[video_stream.end():following if following != -1 else len(banner)]
+    return DISPLAYMATRIX_RE.search(block)
+
+
+def get_keyframes(digest, path):
+    """Return the sorted keyframe timestamps of a stored video, scanning it on first use"""
+    with _lock:
+        if digest in _keyframe_cache:
+            return _keyframe_cache[digest]
+
+    sidecar = os.path.join(STORE_DIR, digest + ".keyframes.json")
+    keyframes = None
+    if os.path.exists(sidecar):
+        try:
+            with open(sidecar) as f:
+                keyframes = json.load(f)
+        except (OSError, ValueError):
+            keyframes = None
+
+    if keyframes is None:
+        with profiling.stage(profiling.PROBE):
+            keyframes = probe_keyframes(path)
+        with open(sidecar, "w") as f:
+            json.dump(keyframes, f)
+
+    with _lock:
+        _keyframe_cache[digest] = keyframes
+    return keyframes
+
+
+def probe_keyframes(path):
+    """List keyframe timestamps by decoding only the keyframes of the first video stream"""
+    result = subprocess.run(
+        [FFMPEG_BINARY, "-hide_banner", "-skip_frame", "nokey", "-i", path,
+         "-map", "0:v:0", "-vf", "showinfo", "-f", "null", "-"],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    banner = result.stderr.decode("utf8", errors="ignore")
+    return sorted(float(t) for t in KEYFRAME_RE.findall(banner))
+
+
+def get_thumbnail_hash(digest, path, duration):
+    """Return the perceptual hash of a stored video's middle frame, computing it on first use"""
+    with _lock:
+        if digest in _thumbnail_cache:
+            return _thumbnail_cache[digest]
+
+    sidecar = os.path.join(STORE_DIR, digest + ".dhash.json")
+    thumbnail_hash = None
+    if os.path.exists(sidecar):
+        try:
+            with open(sidecar) as f:
+                thumbnail_hash = json.load(f)["dhash"]
+        except (OSError, ValueError, KeyError):
+            thumbnail_hash = None
+
+    if thumbnail_hash is None:
+        with profiling.stage(profiling.PROBE):
+            thumbnail_hash = probe_thumbnail_hash(path, duration / 2)
+        with open(sidecar, "w") as f:
+            json.dump({"dhash": thumbnail_hash}, f)
+
+    with _lock:
+        _thumbnail_cache[digest] = thumbnail_hash
+    return thumbnail_hash
+
+
+def probe_thumbnail_hash(path, at):
+    """Difference hash (64 bits, as hex) of one frame, decoded straight to a tiny grayscale grid
+
+    Returns "" when no frame can be decoded, so callers can tell "no hash" from "not computed".
+    """
+    width, height = DHASH_SIZE + 1, DHASH_SIZE
+    result = subprocess.run(
+        [FFMPEG_BINARY, "-hide_banner", "-loglevel", "error", "-ss", f"{at:.3f}", "-i", path,
+         "-frames:v", "1", "-vf", f"scale={width}:{height}:flags=area,format=gray",
+         "-f", "rawvideo", "-"],
+        stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+    pixels = result.stdout
+    if len(pixels) < width * height:
+        return ""
+    bits = 0
+    for y in range(height):
+        row = pixels[y * width:(y + 1) * width]
+        for x in range(DHASH_SIZE):
+            bits = (bits << 1) | (row[x] > row[x + 1])
+    return f"{bits:016x}"